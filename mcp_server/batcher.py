@@ -0,0 +1,69 @@
+# batcher.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+# --- Request Coalescing ---
+
+class Coalescer:
+    """
+    Collects keys submitted within a short window and resolves all of them with a single bulk fetch.
+
+    `flush_fn(client, keys)` must return a mapping of key -> value; keys missing from it resolve to None.
+    If the bulk fetch raises, every caller in the batch receives the exception.
+    A batch that reaches `max_batch` distinct keys is flushed at once instead of waiting out the window.
+    """
+
+    def __init__(
+        self,
+        window_ms: float,
+        flush_fn: Callable[[Any, List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        max_batch: Optional[int] = None,
+    ):
+        self.window = window_ms / 1000
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._client = None
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, client, key: Hashable) -> Any:
+        """Queues `key` for the next bulk fetch (made with `client`) and waits for its value."""
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if self._timer is None:
+                self._client = client
+                self._timer = loop.call_later(self.window, self._flush)
+            if self.max_batch is not None and len(self._pending) >= self.max_batch:
+                self._timer.cancel()
+                self._flush()
+        # Shield so one caller going away does not cancel the value other callers are waiting on.
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        pending, client = self._pending, self._client
+        self._pending, self._client, self._timer = {}, None, None
+        task = asyncio.create_task(self._run(client, pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, client, pending: Dict[Hashable, asyncio.Future]) -> None:
+        try:
+            results = await self.flush_fn(client, list(pending))
+        except asyncio.CancelledError:
+            for future in pending.values():
+                future.cancel()
+            raise
+        except Exception as exc:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(exc)
+                    future.exception()  # Mark as retrieved; callers may have gone away.
+        else:
+            for key, future in pending.items():
+                if not future.done():
+                    future.set_result(results.get(key))
@@ -0,0 +1,122 @@
+# cache.py
+import asyncio
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Hashable, Optional
+from fastapi import Request
+from mcp_server.http_client import is_error
+
+
+# --- Single-Flight TTL Cache ---
+
+class SingleFlightTTL:
+    """
+    Async TTL cache that coalesces concurrent lookups of the same key into a single fetch.
+    Callers arriving while a fetch is in flight await the same result instead of hitting the gateway again.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._store: dict[Hashable, tuple[float, Any]] = {}
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        # Bumped by clear(); a fetch started before a clear() must not store its (possibly stale) result.
+        self._generation = 0
+
+    def clear(self) -> None:
+        """Drops every cached value. In-flight fetches are left to complete, but their results are not stored."""
+        self._store.clear()
+        self._generation += 1
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the cached value for `key`, or None if it is missing or expired."""
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at > time.monotonic():
+            return value
+        del self._store[key]
+        return None
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Stores `value` under `key` for `ttl` seconds (the cache's default TTL if omitted)."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl > 0:
+            self._store[key] = (time.monotonic() + ttl, value)
+
+    async def get_or_fetch(
+        self,
+        key: Hashable,
+        coro_factory: Callable[[], Awaitable[Any]],
+        cacheable: Callable[[Any], bool] = lambda value: True,
+    ) -> Any:
+        """
+        Returns the cached value for `key`, joins an in-flight fetch for it, or runs `coro_factory` to fetch it.
+        Exceptions are propagated to every waiter and never cached; values rejected by `cacheable` are shared but not stored.
+        """
+        while True:
+            entry = self._store.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    return value
+                del self._store[key]
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                # Shield so a waiter being cancelled does not cancel the shared fetch.
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # The fetching caller went away; retry (and fetch ourselves) unless we were cancelled too.
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await coro_factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # Mark as retrieved so unawaited failures are not logged.
+            raise
+        else:
+            if self.ttl > 0 and generation == self._generation and cacheable(value):
+                self._store[key] = (time.monotonic() + self.ttl, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+
+def _is_success(value: Any) -> bool:
+    """Handlers report gateway failures as an error response; those must not be cached."""
+    return not is_error(value)
+
+
+def cached(ttl: float):
+    """
+    Decorates a read-only endpoint with a single-flight TTL cache keyed by its arguments.
+    The `Request` argument is ignored when building the key. Use `endpoint.cache.clear()` to invalidate.
+    With `ttl=0` nothing is stored, but identical concurrent calls still share a single gateway request.
+    """
+    def decorator(func):
+        cache = SingleFlightTTL(ttl)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (
+                tuple(arg for arg in args if not isinstance(arg, Request)),
+                tuple(sorted((name, value) for name, value in kwargs.items() if not isinstance(value, Request))),
+            )
+            return await cache.get_or_fetch(key, lambda: func(*args, **kwargs), cacheable=_is_success)
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
@@ -21,6 +21,13 @@ MCP_SERVER_HOST = os.environ.get("MCP_SERVER_HOST")
 MCP_TRANSPORT_PROTOCOL = os.environ.get("MCP_TRANSPORT_PROTOCOL")
 MCP_SERVER_PORT = os.environ.get("MCP_SERVER_PORT")
 
+# uvicorn event loop and HTTP parser. uvloop/httptools are C implementations; 'auto' falls back when they are missing.
+MCP_SERVER_LOOP = os.getenv("MCP_SERVER_LOOP", "uvloop")
+MCP_SERVER_HTTP = os.getenv("MCP_SERVER_HTTP", "httptools")
+# Answer streamable-http requests with plain JSON instead of an SSE stream. Off by default: GZipMiddleware skips SSE,
+# so set this to true to have tool results gzip-compressed, at the cost of no streamed progress notifications.
+MCP_JSON_RESPONSE = os.getenv("MCP_JSON_RESPONSE", "false").strip().lower() in ("1", "true", "yes")
+
 INCLUDED_TAGS = os.getenv("INCLUDED_TAGS")
 EXCLUDED_TAGS = os.getenv("EXCLUDED_TAGS")
 print(EXCLUDED_TAGS)
@@ -39,6 +46,41 @@ except ValueError:
 BASE_URL = f"{GATEWAY_INTERNAL_BASE_URL}:{GATEWAY_PORT}{GATEWAY_ENDPOINT}"
 print("BASE_URL:", BASE_URL)
 
+# --- IBKR HTTP Client ---
+# Connection pool limits for the shared httpx client used by every router.
+IBKR_MAX_CONNECTIONS = int(os.getenv("IBKR_MAX_CONNECTIONS", 100))
+IBKR_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("IBKR_MAX_KEEPALIVE_CONNECTIONS", 20))
+# Seconds an idle connection is kept open. httpx defaults to 5s, which is shorter than the gap between typical MCP tool calls.
+IBKR_KEEPALIVE_EXPIRY = float(os.getenv("IBKR_KEEPALIVE_EXPIRY", 30))
+# Per-stage timeouts (seconds), so a stalled connect fails fast without capping slow reads.
+IBKR_CONNECT_TIMEOUT = float(os.getenv("IBKR_CONNECT_TIMEOUT", 2))
+IBKR_READ_TIMEOUT = float(os.getenv("IBKR_READ_TIMEOUT", 10))
+IBKR_WRITE_TIMEOUT = float(os.getenv("IBKR_WRITE_TIMEOUT", 5))
+IBKR_POOL_TIMEOUT = float(os.getenv("IBKR_POOL_TIMEOUT", 1))
+# CA bundle used to verify the gateway certificate. When unset, verification is disabled (the gateway ships a self-signed cert).
+IBKR_CA_BUNDLE = os.getenv("IBKR_CA_BUNDLE")
+# Check the certificate's hostname when verifying against IBKR_CA_BUNDLE. Disable to pin a self-signed gateway cert
+# that does not name the host it is reached at (e.g. host.docker.internal or an IP).
+IBKR_SSL_CHECK_HOSTNAME = os.getenv("IBKR_SSL_CHECK_HOSTNAME", "true").strip().lower() in ("1", "true", "yes")
+# OpenSSL cipher string for TLS 1.2 connections to the gateway (TLS 1.3 suites are not affected). Empty keeps OpenSSL's defaults.
+IBKR_SSL_CIPHERS = os.getenv("IBKR_SSL_CIPHERS", "ECDHE+AESGCM")
+# Transport under the httpx client: "httpx" (default) or "aiohttp" (via httpx-aiohttp). Benchmark before switching.
+IBKR_HTTP_TRANSPORT = os.getenv("IBKR_HTTP_TRANSPORT", "httpx").strip().lower()
+# Negotiate HTTP/2 with the gateway (falls back to HTTP/1.1 when it is not offered). Set to false to force HTTP/1.1.
+IBKR_HTTP2 = os.getenv("IBKR_HTTP2", "true").strip().lower() in ("1", "true", "yes")
+# Upper bound (seconds) on how long a history response is reused; shorter bar sizes are cached for one bar.
+IBKR_HISTORY_CACHE_TTL = float(os.getenv("IBKR_HISTORY_CACHE_TTL", 60))
+# Seconds between background /hmds/auth/init calls that keep the HMDS session authenticated.
+IBKR_HMDS_AUTH_REFRESH = float(os.getenv("IBKR_HMDS_AUTH_REFRESH", 300))
+# Retries for failed connects (in the transport) and, for GETs only, dropped connections and 5xx responses.
+IBKR_RETRIES = int(os.getenv("IBKR_RETRIES", 3))
+# Base delay (seconds) before a GET is retried; doubles on each attempt.
+IBKR_RETRY_BACKOFF = float(os.getenv("IBKR_RETRY_BACKOFF", 0.2))
+# Max gateway requests in flight at once; further calls queue for a free slot.
+IBKR_MAX_CONCURRENCY = int(os.getenv("IBKR_MAX_CONCURRENCY", 32))
+# Seconds a call waits for a free slot before it is rejected with 503 instead of piling more load on the gateway.
+IBKR_QUEUE_TIMEOUT = float(os.getenv("IBKR_QUEUE_TIMEOUT", 1))
+
 # Create FastAPI object description based on filters
 base_description = """
 A comprehensive FastAPI wrapper for the Interactive Brokers Web API. 
@@ -1,8 +1,14 @@
 import os
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.middleware import Middleware
+import httpx
 from fastmcp import FastMCP
 from fastmcp.server.openapi import RouteMap, MCPType
-from mcp_server.config import MCP_SERVER_HOST, MCP_SERVER_PORT, MCP_TRANSPORT_PROTOCOL, FINAL_DESCRIPTION, EXCLUDED_TAGS_SET
+from mcp_server.config import MCP_SERVER_HOST, MCP_SERVER_PORT, MCP_SERVER_LOOP, MCP_SERVER_HTTP, MCP_JSON_RESPONSE, MCP_TRANSPORT_PROTOCOL, FINAL_DESCRIPTION, EXCLUDED_TAGS_SET
+from mcp_server.http_client import api_error, lifespan, request_error
 
 # Import Router Files
 import alerts
@@ -23,9 +29,21 @@ import watchlists
 app = FastAPI(
     title="IBKR API",
     description=FINAL_DESCRIPTION,
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# Gateway errors raised past a handler get the same response as the ones ibkr() returns,
+# so handlers never need their own try/except around gateway calls.
+@app.exception_handler(httpx.HTTPStatusError)
+async def gateway_status_error(request: Request, exc: httpx.HTTPStatusError):
+    return api_error(exc.response.status_code, exc.response.text)
+
+@app.exception_handler(httpx.RequestError)
+async def gateway_request_error(request: Request, exc: httpx.RequestError):
+    return request_error(exc)
+
 app.include_router(alerts.router)
 app.include_router(contract.router)
 app.include_router(events_contracts.router)
@@ -48,9 +66,18 @@ if EXCLUDED_TAGS_SET:
         route_maps_list.append(RouteMap(tags={tag_}, mcp_type=MCPType.EXCLUDE))
 
 
+# FastMCP calls the app in-process without sending ASGI lifespan events,
+# so run the app's lifespan (shared IBKR client, etc.) as the server lifespan.
+@asynccontextmanager
+async def mcp_lifespan(server):
+    async with app.router.lifespan_context(app):
+        yield
+
+
 mcp = FastMCP.from_fastapi(
     app=app,
     route_maps = route_maps_list,
+    lifespan=mcp_lifespan,
     )
 
 if __name__ == "__main__":
@@ -59,4 +86,10 @@ if __name__ == "__main__":
         host=MCP_SERVER_HOST,
         port=MCP_SERVER_PORT,
         log_level="DEBUG",
+        # Compress large tool results (history bars, order lists) for remote MCP clients. Starlette skips
+        # text/event-stream, so results are only compressed when they are sent as plain JSON (MCP_JSON_RESPONSE).
+        middleware=[Middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)],
+        json_response=MCP_JSON_RESPONSE,
+        # libuv event loop and C HTTP parser instead of the pure-Python defaults.
+        uvicorn_config={"loop": MCP_SERVER_LOOP, "http": MCP_SERVER_HTTP},
     )
@@ -0,0 +1,334 @@
+# http_client.py
+import asyncio
+import ssl
+from contextlib import asynccontextmanager
+from functools import wraps
+from typing import Any
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import httpx
+import orjson
+from pydantic import BaseModel
+from mcp_server.config import (
+    BASE_URL,
+    IBKR_MAX_CONNECTIONS,
+    IBKR_MAX_KEEPALIVE_CONNECTIONS,
+    IBKR_KEEPALIVE_EXPIRY,
+    IBKR_CONNECT_TIMEOUT,
+    IBKR_READ_TIMEOUT,
+    IBKR_WRITE_TIMEOUT,
+    IBKR_POOL_TIMEOUT,
+    IBKR_CA_BUNDLE,
+    IBKR_SSL_CHECK_HOSTNAME,
+    IBKR_SSL_CIPHERS,
+    IBKR_HTTP_TRANSPORT,
+    IBKR_HTTP2,
+    IBKR_RETRIES,
+    IBKR_RETRY_BACKOFF,
+    IBKR_MAX_CONCURRENCY,
+    IBKR_QUEUE_TIMEOUT,
+)
+
+
+# --- Timeouts ---
+
+def read_timeout(seconds: float) -> httpx.Timeout:
+    """
+    Returns the default timeout with a longer read budget, for endpoints that are slow to respond.
+    """
+    return httpx.Timeout(
+        connect=IBKR_CONNECT_TIMEOUT,
+        read=seconds,
+        write=IBKR_WRITE_TIMEOUT,
+        pool=IBKR_POOL_TIMEOUT,
+    )
+
+DEFAULT_TIMEOUT = read_timeout(IBKR_READ_TIMEOUT)
+
+# Prefer brotli for large gateway payloads (strikes, secdef lists, notifications); httpx decodes it transparently.
+CLIENT_HEADERS = {"accept-encoding": "br, gzip"}
+
+# Headers for request bodies that are already serialized JSON (e.g. `model.model_dump_json()`).
+JSON_HEADERS = {"content-type": "application/json"}
+
+
+# --- TLS ---
+
+def create_ssl_context() -> ssl.SSLContext:
+    """
+    Builds the SSL context shared by every connection to the gateway.
+    Verifies against `IBKR_CA_BUNDLE` when it is set (e.g. the gateway's own self-signed cert, pinned);
+    otherwise keeps the previous unverified behaviour. TLS 1.2 cipher suites are restricted to `IBKR_SSL_CIPHERS`.
+    ALPN is left to httpcore, which offers h2 on this context when `IBKR_HTTP2` is on.
+    """
+    if IBKR_CA_BUNDLE:
+        ctx = ssl.create_default_context(cafile=IBKR_CA_BUNDLE)
+        ctx.check_hostname = IBKR_SSL_CHECK_HOSTNAME
+    else:
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    if IBKR_SSL_CIPHERS:
+        # AEAD suites only: AES-GCM runs on AES-NI, and CBC/SHA1 suites are never negotiated.
+        ctx.set_ciphers(IBKR_SSL_CIPHERS)
+    return ctx
+
+
+# --- Shared IBKR Client ---
+
+def create_client() -> httpx.AsyncClient:
+    """
+    Builds the pooled httpx client used for every gateway call.
+    With `IBKR_HTTP_TRANSPORT=aiohttp` requests are sent through an aiohttp session instead of httpx's own transport.
+    """
+    ssl_context = create_ssl_context()
+    if IBKR_HTTP_TRANSPORT == "aiohttp":
+        # Optional transport; only imported when selected.
+        import aiohttp
+        from httpx_aiohttp import AiohttpTransport
+
+        # Same pool size and idle keep-alive as the httpx transport, so switching transports does not change pooling.
+        connector = aiohttp.TCPConnector(
+            ssl=ssl_context,
+            limit=IBKR_MAX_CONNECTIONS,
+            keepalive_timeout=IBKR_KEEPALIVE_EXPIRY,
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        return httpx.AsyncClient(
+            base_url=BASE_URL,
+            transport=AiohttpTransport(client=session),
+            headers=CLIENT_HEADERS,
+            timeout=DEFAULT_TIMEOUT,
+        )
+    transport = httpx.AsyncHTTPTransport(
+        verify=ssl_context,
+        # Multiplex concurrent tool calls over one connection when the gateway negotiates h2 (falls back to HTTP/1.1).
+        http2=IBKR_HTTP2,
+        limits=httpx.Limits(
+            max_keepalive_connections=IBKR_MAX_KEEPALIVE_CONNECTIONS,
+            max_connections=IBKR_MAX_CONNECTIONS,
+            keepalive_expiry=IBKR_KEEPALIVE_EXPIRY,
+        ),
+        # Retries connection failures only; nothing has been sent yet, so this is safe for every method.
+        retries=IBKR_RETRIES,
+    )
+    return httpx.AsyncClient(
+        base_url=BASE_URL,
+        transport=transport,
+        headers=CLIENT_HEADERS,
+        timeout=DEFAULT_TIMEOUT,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Creates a single pooled httpx client for the lifetime of the app and stores it on `app.state.ibkr`.
+    Routers reuse it so connections (and TLS sessions) to the gateway are kept alive between calls.
+    """
+    app.state.ibkr = create_client()
+    try:
+        yield
+    finally:
+        await app.state.ibkr.aclose()
+
+
+# --- Concurrency Limit ---
+# Bursts of tool calls are queued here instead of being fired at the gateway all at once, which it answers with 429s.
+
+class GatewayBusy(httpx.RequestError):
+    """Raised when no gateway slot frees up within `IBKR_QUEUE_TIMEOUT`; reported to the caller as 503."""
+
+
+_gate = asyncio.Semaphore(IBKR_MAX_CONCURRENCY)
+
+@asynccontextmanager
+async def gateway_slot():
+    """Holds one of the `IBKR_MAX_CONCURRENCY` gateway slots, raising `GatewayBusy` if none frees up in time."""
+    try:
+        await asyncio.wait_for(_gate.acquire(), IBKR_QUEUE_TIMEOUT)
+    except TimeoutError:
+        raise GatewayBusy(f"Too many concurrent IBKR requests (limit {IBKR_MAX_CONCURRENCY}); try again shortly.") from None
+    try:
+        yield
+    finally:
+        _gate.release()
+
+
+# --- Request Helpers ---
+
+def query(**params) -> dict:
+    """
+    Builds query params in one pass, dropping arguments that were not supplied.
+    httpx would otherwise send a `None` value as an empty `key=`.
+    """
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def json_body(model: type[BaseModel]) -> dict:
+    """
+    Returns `openapi_extra` documenting `model` as the JSON request body, for endpoints that forward the raw body
+    from `await request.body()` without validating it. The schema (and so the MCP tool's parameters) stays the same.
+    """
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": model.model_json_schema()}}}}
+
+
+# --- Error Responses ---
+# Gateway failures keep the upstream status (network failures become 502), so MCP clients see a failed
+# tool call rather than a successful one carrying an error payload.
+
+def api_error(status_code: int, detail: str) -> ORJSONResponse:
+    return ORJSONResponse(
+        {"error": "IBKR API Error", "status_code": status_code, "detail": detail},
+        status_code=status_code,
+    )
+
+
+def request_error(exc: httpx.RequestError) -> ORJSONResponse:
+    status_code = 503 if isinstance(exc, GatewayBusy) else 502
+    return ORJSONResponse({"error": "Request Error", "detail": str(exc)}, status_code=status_code)
+
+
+def error_body(exc: httpx.HTTPError) -> dict:
+    """Returns the payload `api_error()`/`request_error()` would send for `exc`, for embedding in a combined response."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
+    return {"error": "Request Error", "detail": str(exc)}
+
+
+def is_error(payload: Any) -> bool:
+    """Returns True for the error response `ibkr()` returns in place of a gateway payload."""
+    return isinstance(payload, Response) and payload.status_code >= 400
+
+
+def ibkr_errors(func):
+    """
+    Turns httpx errors raised by an endpoint that calls the gateway client directly (e.g. through a batcher)
+    into the same error responses `ibkr()` returns.
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except httpx.HTTPStatusError as exc:
+            return api_error(exc.response.status_code, exc.response.text)
+        except httpx.RequestError as exc:
+            return request_error(exc)
+    return wrapper
+
+
+# Only idempotent requests are replayed after a dropped connection or a 5xx; a replayed POST could place an order twice.
+RETRY_METHODS = frozenset({"GET"})
+
+async def send(client: httpx.AsyncClient, method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Sends a request, retrying GETs with exponential backoff when the gateway drops the connection or answers 5xx.
+    The last response (or error) is returned as-is once `IBKR_RETRIES` is exhausted.
+    Each attempt holds a gateway slot; the slot is released while backing off.
+    """
+    retries = IBKR_RETRIES if method in RETRY_METHODS else 0
+    for attempt in range(retries + 1):
+        try:
+            async with gateway_slot():
+                response = await client.request(method, path, **kwargs)
+        except (httpx.RemoteProtocolError, httpx.ReadError):
+            # A pooled keep-alive connection the gateway already closed.
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code < 500 or attempt == retries:
+                return response
+        await asyncio.sleep(IBKR_RETRY_BACKOFF * 2 ** attempt)
+
+
+# --- Conditional Requests ---
+# Responses that carried an ETag or Last-Modified, with the headers to revalidate them, keyed by (path, params).
+# Only endpoints opting in with `revalidate=True` are tracked; their keys are few (one per account).
+_validated: dict[tuple, tuple[dict, Response]] = {}
+
+def _conditions(response: httpx.Response) -> dict:
+    conditions = {}
+    if etag := response.headers.get("etag"):
+        conditions["if-none-match"] = etag
+    if last_modified := response.headers.get("last-modified"):
+        conditions["if-modified-since"] = last_modified
+    return conditions
+
+
+async def ibkr(
+    request: Request, method: str, path: str, *, passthrough: bool = False, revalidate: bool = False, **kwargs
+) -> Any:
+    """
+    Sends a request to the gateway through the shared client and returns its JSON body as a ready-made response.
+    Returning a `Response` lets FastAPI skip `jsonable_encoder` on large payloads.
+    With `passthrough=True` the gateway's bytes are forwarded as-is, skipping the parse/encode round trip
+    for payloads (e.g. history bars) that are returned unchanged.
+    With `revalidate=True` a previous response that carried an ETag/Last-Modified is revalidated with a conditional
+    request, and reused when the gateway answers 304.
+    Gateway and network failures are returned as an error response instead of being raised.
+    """
+    key = previous = None
+    if revalidate:
+        key = (path, repr(kwargs.get("params")))
+        previous = _validated.get(key)
+        if previous is not None:
+            kwargs["headers"] = {**kwargs.get("headers", {}), **previous[0]}
+    try:
+        response = await send(request.app.state.ibkr, method, path, **kwargs)
+        if previous is not None and response.status_code == 304:
+            return previous[1]
+        response.raise_for_status()
+        if passthrough:
+            result = Response(
+                content=response.content,
+                status_code=response.status_code,
+                media_type=response.headers.get("content-type", "application/json"),
+            )
+        else:
+            result = ORJSONResponse(orjson.loads(response.content))
+    except httpx.HTTPStatusError as exc:
+        return api_error(exc.response.status_code, exc.response.text)
+    except httpx.RequestError as exc:
+        return request_error(exc)
+    if revalidate and (conditions := _conditions(response)):
+        _validated[key] = (conditions, result)
+    return result
+
+
+async def _forward(upstream: httpx.Response):
+    """
+    Yields the upstream body and closes the upstream response however iteration ends. A background task would be
+    skipped when the client disconnects, leaving the pooled connection (or HTTP/2 stream) checked out.
+    """
+    try:
+        # aiter_bytes() (not aiter_raw()) so brotli/gzip from the gateway is decoded before it is forwarded.
+        async for chunk in upstream.aiter_bytes():
+            yield chunk
+    finally:
+        await upstream.aclose()
+
+
+async def ibkr_stream(request: Request, method: str, path: str, **kwargs) -> Any:
+    """
+    Like `ibkr(passthrough=True)`, but streams the gateway body to the caller chunk by chunk instead of buffering it,
+    so large payloads (multi-year history) hold one chunk in memory rather than the whole response.
+    Error responses are read in full and returned as the usual error response. Streamed requests are not retried.
+    """
+    client = request.app.state.ibkr
+    try:
+        # The slot covers the request and response headers; the body is streamed after it is released.
+        async with gateway_slot():
+            upstream = await client.send(client.build_request(method, path, **kwargs), stream=True)
+    except httpx.RequestError as exc:
+        return request_error(exc)
+    if upstream.is_error:
+        try:
+            await upstream.aread()
+        finally:
+            await upstream.aclose()
+        return api_error(upstream.status_code, upstream.text)
+    return StreamingResponse(
+        _forward(upstream),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get("content-type", "application/json"),
+    )
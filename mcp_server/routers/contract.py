@@ -1,9 +1,12 @@
 # contract.py
-from fastapi import APIRouter, Query, Body, Path
+import asyncio
+from fastapi import APIRouter, Query, Body, Path, Request
 from typing import List, Optional
 import httpx
 from pydantic import BaseModel, Field, ConfigDict
-from mcp_server.config import BASE_URL
+from mcp_server.batcher import Coalescer
+from mcp_server.cache import cached
+from mcp_server.http_client import JSON_HEADERS, ibkr, ibkr_errors, query, send
 
 router = APIRouter()
 
@@ -15,6 +18,7 @@ class ContractRulesRequest(BaseModel):
     isBuy: bool = Field(..., description="Specify true for buy side rules, false for sell side rules.")
 
     model_config = ConfigDict(
+        frozen=True,
         json_schema_extra = {
             "example": {
                 "conid": 265598, # IBM
@@ -24,6 +28,28 @@ class ContractRulesRequest(BaseModel):
     )
 
 
+# --- Bulk Lookups ---
+# Lookups arriving within a few milliseconds of each other are merged into one
+# comma-separated request to the list endpoints and split back out per caller.
+
+_BATCH_WINDOW_MS = 5
+# Keys per gateway request; a fuller batch is sent at once so the query string stays short.
+_BATCH_MAX = 50
+
+async def _fetch_secdefs(client: httpx.AsyncClient, conids: List[str]) -> dict:
+    response = await send(client, "GET", "/trsrv/secdef", params={"conids": ",".join(conids)})
+    response.raise_for_status()
+    return {str(secdef.get("conid")): secdef for secdef in response.json().get("secdef", [])}
+
+async def _fetch_stocks(client: httpx.AsyncClient, symbols: List[str]) -> dict:
+    response = await send(client, "GET", "/trsrv/stocks", params={"symbols": ",".join(symbols)})
+    response.raise_for_status()
+    return {symbol.upper(): stocks for symbol, stocks in response.json().items()}
+
+_secdef_batcher = Coalescer(_BATCH_WINDOW_MS, _fetch_secdefs, max_batch=_BATCH_MAX)
+_stocks_batcher = Coalescer(_BATCH_WINDOW_MS, _fetch_stocks, max_batch=_BATCH_MAX)
+
+
 # --- Contract Router Endpoints ---
 
 @router.get(
@@ -33,6 +59,7 @@ class ContractRulesRequest(BaseModel):
     description="Returns a list of available IB Algos for a contract."
 )
 async def get_contract_algos(
+    request: Request,
     conid: int = Path(..., description="The contract ID."),
     algos: Optional[str] = Query(None, description="A comma-separated list of IB Algos to query."),
     addDescription: Optional[str] = Query(None, description="Set to 1 to receive algorithm descriptions."),
@@ -41,23 +68,8 @@ async def get_contract_algos(
     """
     Retrieves a list of supported IB Algos for a given instrument.
     """
-    params = {}
-    if algos:
-        params["algos"] = algos
-    if addDescription:
-        params["addDescription"] = addDescription
-    if addParams:
-        params["addParams"] = addParams
-
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/contract/{conid}/algos", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = query(algos=algos, addDescription=addDescription, addParams=addParams)
+    return await ibkr(request, "GET", f"/iserver/contract/{conid}/algos", params=params)
 
 @router.get(
     "/iserver/contract/{conid}/info-and-rules",
@@ -66,6 +78,7 @@ async def get_contract_algos(
     description="Returns a conglomeration of contract information and trading rules."
 )
 async def get_contract_info_and_rules(
+    request: Request,
     conid: int = Path(..., description="The contract ID."),
     isBuy: bool = Query(..., description="Side of the market: true for Buy, false for Sell.")
 ):
@@ -73,15 +86,7 @@ async def get_contract_info_and_rules(
     Retrieves a combination of contract details and associated trading rules in a single call.
     """
     params = {"isBuy": isBuy}
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/contract/{conid}/info-and-rules", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/iserver/contract/{conid}/info-and-rules", params=params)
 
 
 @router.get(
@@ -90,21 +95,15 @@ async def get_contract_info_and_rules(
     summary="Contract Information",
     description="Get full contract details for a given contract ID (conid)."
 )
+@cached(ttl=30)
 async def get_contract_info(
+    request: Request,
     conid: int = Path(..., description="The contract ID.")
 ):
     """
     Retrieves detailed information about a specific contract using its conid.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/contract/{conid}/info", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/iserver/contract/{conid}/info")
 
 @router.get(
     "/iserver/secdef/bond-filters",
@@ -112,7 +111,9 @@ async def get_contract_info(
     summary="Get Bond Filters",
     description="Returns a list of available bond filters for a given issuer."
 )
+@cached(ttl=300)
 async def get_bond_filters(
+    request: Request,
     issuerId: str = Query(..., description="Specifies the issuerId value used to designate the bond issuer type.")
 ):
     """
@@ -122,15 +123,7 @@ async def get_bond_filters(
         "symbol": "BOND",
         "issuerId": issuerId
     }
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/secdef/bond-filters", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/iserver/secdef/bond-filters", params=params)
 
 @router.get(
     "/iserver/secdef/currency",
@@ -138,22 +131,16 @@ async def get_bond_filters(
     summary="Search Currency Pairs",
     description="Search for currency pairs."
 )
+@cached(ttl=30)
 async def search_currency_pairs(
+    request: Request,
     symbol: str = Query(..., description="The currency pair (e.g., EUR.USD).")
 ):
     """
     Retrieves information about a currency pair. Corresponds to the user's request for /iserver/currency/pairs.
     """
     params = {"symbol": symbol}
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/secdef/currency", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/iserver/secdef/currency", params=params)
 
 @router.get(
     "/iserver/secdef/info",
@@ -161,7 +148,9 @@ async def search_currency_pairs(
     summary="Secdef Info",
     description="Provides security definition and rules information for a given conid."
 )
+@cached(ttl=30)
 async def get_secdef_info(
+    request: Request,
     conid: str = Query(..., description="The contract ID."),
     secType: str = Query(..., description="The security type."),
     month: Optional[str] = Query(None, description="The expiration month for options/futures (e.g., 'DEC23')."),
@@ -172,25 +161,8 @@ async def get_secdef_info(
     """
     A comprehensive endpoint to get instrument metadata and rules in one call.
     """
-    params = {"conid": conid, "secType": secType}
-    if month:
-        params["month"] = month
-    if exchange:
-        params["exchange"] = exchange
-    if strike:
-        params["strike"] = strike
-    if right:
-        params["right"] = right
-
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/secdef/info", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = query(conid=conid, secType=secType, month=month, exchange=exchange, strike=strike, right=right)
+    return await ibkr(request, "GET", "/iserver/secdef/info", params=params)
 
 @router.get(
     "/iserver/secdef/search",
@@ -198,7 +170,9 @@ async def get_secdef_info(
     summary="Search by Symbol or Name",
     description="Search for contracts by symbol or company name. Returns a list of matching contracts."
 )
+@cached(ttl=30)
 async def search_contract_by_symbol_or_name(
+    request: Request,
     symbol: str = Query(..., description="The symbol or company name to search for."),
     name: Optional[bool] = Query(False, description="Set to true to search by company name instead of symbol."),
     secType: Optional[str] = Query(None, description="The security type to filter by (e.g., STK, OPT, FUT).")
@@ -206,21 +180,9 @@ async def search_contract_by_symbol_or_name(
     """
     Searches for contracts based on a symbol or name. This is a primary method for finding a contract's conid.
     """
-    params = {"symbol": symbol}
-    if name is not None:
-        params["name"] = str(name).lower()
-    if secType:
-        params["secType"] = secType
-
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/secdef/search", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    # httpx sends booleans as "true"/"false".
+    params = query(symbol=symbol, name=name, secType=secType)
+    return await ibkr(request, "GET", "/iserver/secdef/search", params=params)
 
 @router.post(
     "/iserver/contract/rules",
@@ -228,23 +190,11 @@ async def search_contract_by_symbol_or_name(
     summary="Contract Rules",
     description="Returns trading rules for a contract. The request body requires the conid and a boolean for the side."
 )
-async def get_contract_rules(body: ContractRulesRequest = Body(...)):
+async def get_contract_rules(request: Request, body: ContractRulesRequest = Body(...)):
     """
     Fetches the trading rules for a given contract, such as order types and sizes.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/iserver/contract/rules",
-                json=body.model_dump(),
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "POST", "/iserver/contract/rules", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS)
 
 @router.get(
     "/iserver/secdef/strikes",
@@ -252,7 +202,9 @@ async def get_contract_rules(body: ContractRulesRequest = Body(...)):
     summary="Option Strikes",
     description="Get a list of available option strikes for a given underlying contract ID (conid)."
 )
+@cached(ttl=30)
 async def get_strikes(
+    request: Request,
     conid: int = Query(..., description="The contract ID of the underlying security."),
     secType: str = Query(..., description="The security type (e.g., OPT, WAR)."),
     month: str = Query(..., description="The expiration month in 'MMMYY' format (e.g., JAN25)."),
@@ -261,19 +213,8 @@ async def get_strikes(
     """
     Retrieves available strike prices for an options contract based on the underlying conid, security type, and expiration.
     """
-    params = {"conid": conid, "secType": secType, "month": month}
-    if exchange:
-        params["exchange"] = exchange
-        
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/secdef/strikes", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = query(conid=conid, secType=secType, month=month, exchange=exchange)
+    return await ibkr(request, "GET", "/iserver/secdef/strikes", params=params)
 
 @router.get(
     "/trsrv/futures",
@@ -281,22 +222,16 @@ async def get_strikes(
     summary="Futures Details by Symbol",
     description="Returns a list of futures for the given symbols."
 )
+@cached(ttl=30)
 async def get_trsrv_futures_by_symbol(
+    request: Request,
     symbols: str = Query(..., description="A comma-separated list of underlying symbols.")
 ):
     """
     Get detailed information about futures contracts for given symbols.
     """
     params = {"symbols": symbols}
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/trsrv/futures", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/trsrv/futures", params=params)
 
 @router.get(
     "/trsrv/secdef",
@@ -304,22 +239,19 @@ async def get_trsrv_futures_by_symbol(
     summary="Security Definitions by Conid",
     description="Returns a list of security definitions for the given conids."
 )
+@cached(ttl=30)
+@ibkr_errors
 async def get_secdef_by_conids(
+    request: Request,
     conids: str = Query(..., description="A comma-separated list of contract IDs.")
 ):
     """
     Retrieves security definitions for one or more contracts.
     """
-    params = {"conids": conids}
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/trsrv/secdef", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    conid_list = [conid.strip() for conid in conids.split(",") if conid.strip()]
+    client = request.app.state.ibkr
+    secdefs = await asyncio.gather(*(_secdef_batcher.submit(client, conid) for conid in conid_list))
+    return {"secdef": [secdef for secdef in secdefs if secdef is not None]}
 
 @router.get(
     "/trsrv/stocks",
@@ -327,22 +259,19 @@ async def get_secdef_by_conids(
     summary="Stocks by Symbol",
     description="Returns a list of stock contracts for the given symbols."
 )
+@cached(ttl=30)
+@ibkr_errors
 async def get_stocks_by_symbol(
+    request: Request,
     symbols: str = Query(..., description="A comma-separated list of stock symbols.")
 ):
     """
     Fetches stock contracts for a list of symbols. This is more direct than a general search if you know you are looking for stocks.
     """
-    params = {"symbols": symbols}
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/trsrv/stocks", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    symbol_list = [symbol.strip() for symbol in symbols.split(",") if symbol.strip()]
+    client = request.app.state.ibkr
+    stocks = await asyncio.gather(*(_stocks_batcher.submit(client, symbol.upper()) for symbol in symbol_list))
+    return {symbol: found for symbol, found in zip(symbol_list, stocks) if found is not None}
 
 @router.get(
     "/trsrv/secdef/schedule",
@@ -350,7 +279,9 @@ async def get_stocks_by_symbol(
     summary="Trading Schedule",
     description="Returns the trading schedule for a contract."
 )
+@cached(ttl=300)
 async def get_trading_schedule(
+    request: Request,
     assetClass: str = Query(..., description="The asset class of the contract, e.g., 'STK', 'OPT', 'FUT'."),
     symbol: str = Query(..., description="The underlying symbol."),
     exchange: Optional[str] = Query(None, description="The exchange to query."),
@@ -359,18 +290,5 @@ async def get_trading_schedule(
     """
     Retrieves the trading schedule for a given contract.
     """
-    params = {"assetClass": assetClass, "symbol": symbol}
-    if exchange:
-        params["exchange"] = exchange
-    if exchangeFilter:
-        params["exchangeFilter"] = exchangeFilter
-
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/trsrv/secdef/schedule", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = query(assetClass=assetClass, symbol=symbol, exchange=exchange, exchangeFilter=exchangeFilter)
+    return await ibkr(request, "GET", "/trsrv/secdef/schedule", params=params)
@@ -1,9 +1,8 @@
 # fa_allocation_management.py
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Body, Request
 from typing import List
-import httpx
-from pydantic import BaseModel, Field, ConfigDict
-from mcp_server.config import BASE_URL
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
+from mcp_server.http_client import JSON_HEADERS, ibkr
 
 router = APIRouter()
 
@@ -14,6 +13,8 @@ class AccountAllocation(BaseModel):
     id: str = Field(..., description="The account ID.")
     amount: float = Field(..., description="The allocation amount or percentage for this account.")
 
+    model_config = ConfigDict(frozen=True)
+
 class FAGroup(BaseModel):
     """
     Model representing a Financial Advisor (FA) group for creation.
@@ -23,6 +24,7 @@ class FAGroup(BaseModel):
     accounts: List[AccountAllocation] = Field(..., description="A list of accounts and their allocations within the group.")
 
     model_config = ConfigDict(
+        frozen=True,
         json_schema_extra = {
             "example": {
                 "name": "MyTestGroup",
@@ -35,6 +37,9 @@ class FAGroup(BaseModel):
         }
     )
 
+# Serializes the request body straight to JSON bytes in pydantic-core, with no dict or str intermediate.
+_FA_GROUPS = TypeAdapter(List[FAGroup])
+
 
 # --- FA Allocation Management Router Endpoints ---
 
@@ -44,19 +49,11 @@ class FAGroup(BaseModel):
     summary="Get FA Groups",
     description="Returns a list of all Financial Advisor (FA) allocation groups for the currently connected financial advisor."
 )
-async def get_fa_groups():
+async def get_fa_groups(request: Request):
     """
     Retrieves all FA groups for the advisor. These groups are used for trade allocation.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/fa/groups", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/fa/groups")
 
 @router.post(
     "/fa/groups",
@@ -64,24 +61,13 @@ async def get_fa_groups():
     summary="Create FA Group",
     description="Creates a new Financial Advisor (FA) allocation group. This endpoint requires the group name, allocation method, and a list of accounts."
 )
-async def create_fa_group(body: FAGroup = Body(...)):
+async def create_fa_group(request: Request, body: FAGroup = Body(...)):
     """
     Creates a new FA group with a specified allocation method and accounts.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            # The API documentation implies the list of accounts is sent directly as the body.
-            # We'll structure it based on the Pydantic model, which aligns with common REST practices.
-            # The actual JSON sent will be the list of FAGroup models if the API expects a list.
-            # For a single group creation, sending the single object's dict is correct.
-            response = await client.post(
-                f"{BASE_URL}/fa/groups",
-                json=[body.model_dump()], # The doc example suggests sending a list containing one group object
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    # The API documentation implies the list of accounts is sent directly as the body.
+    # We'll structure it based on the Pydantic model, which aligns with common REST practices.
+    # The actual JSON sent will be the list of FAGroup models if the API expects a list.
+    # For a single group creation, sending the single object's dict is correct.
+    # The doc example suggests sending a list containing one group object
+    return await ibkr(request, "POST", "/fa/groups", content=_FA_GROUPS.dump_json([body], exclude_none=True), headers=JSON_HEADERS)
@@ -1,36 +1,52 @@
 # fyis_and_notifications.py
-from fastapi import APIRouter, Body, Path, Query
+from fastapi import APIRouter, Body, Path, Query, Request
 from typing import List, Optional
-import httpx
 from pydantic import BaseModel, Field, ConfigDict
-from mcp_server.config import BASE_URL
+from mcp_server.cache import cached
+from mcp_server.http_client import JSON_HEADERS, ibkr, query, read_timeout
 
 router = APIRouter()
 
+# Upper bound on the page size forwarded to /fyi/notifications.
+MAX_NOTIFICATIONS = 500
+
+# How long a polled unread count or notification list is served before asking the gateway again.
+UNREAD_TTL = 2
+
 # --- Pydantic Models for FYI Requests ---
 
 class DeliveryOptionsRequest(BaseModel):
     """Request model for enabling/disabling notifications."""
     enabled: bool = Field(..., description="True to enable, false to disable.")
 
+    model_config = ConfigDict(frozen=True)
+
 class DeviceDeliveryOptionsRequest(BaseModel):
     """Request model for enabling/disabling device notifications."""
     deviceId: str = Field(..., description="The device ID.")
     uiName: str = Field(..., description="The name of the UI.")
     enabled: bool = Field(..., description="True to enable, false to disable.")
 
+    model_config = ConfigDict(frozen=True)
+
 class FYISettingsGetRequest(BaseModel):
     """Request model for getting a list of disclaimer notifications."""
     typeCodes: List[str] = Field(..., description="A list of FYI type codes.")
 
+    model_config = ConfigDict(frozen=True)
+
 class FYISettingsRequest(BaseModel):
     """Request model for enabling/disabling disclaimer type notifications."""
     enabled: bool = Field(..., description="True to enable, false to disable.")
 
+    model_config = ConfigDict(frozen=True)
+
 class MarkReadRequest(BaseModel):
     """Request model for marking notifications as read."""
     notificationIds: List[str] = Field(..., description="A list of notification IDs to mark as read.")
 
+    model_config = ConfigDict(frozen=True)
+
 
 # --- FYIs and Notifications Router Endpoints ---
 
@@ -40,19 +56,13 @@ class MarkReadRequest(BaseModel):
     summary="Get Unread Number of FYIs",
     description="Returns the total number of unread FYI notifications."
 )
-async def get_fyi_unread_number():
+# Polled by clients every few seconds; share one gateway call per window across all of them.
+@cached(ttl=UNREAD_TTL)
+async def get_fyi_unread_number(request: Request):
     """
     Retrieves the count of unread notifications.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/fyi/unreadnumber", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/fyi/unreadnumber")
 
 @router.get(
     "/fyi/deliveryoptions",
@@ -60,19 +70,12 @@ async def get_fyi_unread_number():
     summary="Get FYI Delivery Options",
     description="Returns a list of all supported delivery options."
 )
-async def get_fyi_delivery_options():
+@cached(ttl=30)
+async def get_fyi_delivery_options(request: Request):
     """
     Fetches the available FYI delivery options.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/fyi/deliveryoptions", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/fyi/deliveryoptions")
 
 
 @router.post(
@@ -81,19 +84,13 @@ async def get_fyi_delivery_options():
     summary="Enable/Disable FYI Delivery Options",
     description="Enables or disables a delivery option."
 )
-async def configure_fyi_delivery_options(body: DeliveryOptionsRequest = Body(...)):
+async def configure_fyi_delivery_options(request: Request, body: DeliveryOptionsRequest = Body(...)):
     """
     Enables or disables a specific FYI delivery option.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(f"{BASE_URL}/fyi/deliveryoptions", json=body.model_dump(), timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "POST", "/fyi/deliveryoptions", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS)
+    get_fyi_delivery_options.cache.clear()
+    return result
 
 
 @router.put(
@@ -102,19 +99,13 @@ async def configure_fyi_delivery_options(body: DeliveryOptionsRequest = Body(...
     summary="Enable Device Notifications",
     description="Enables or disables notifications for a specific device."
 )
-async def configure_device_delivery_options(body: DeviceDeliveryOptionsRequest = Body(...)):
+async def configure_device_delivery_options(request: Request, body: DeviceDeliveryOptionsRequest = Body(...)):
     """
     Configures FYI notifications for a specific device.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.put(f"{BASE_URL}/fyi/deliveryoptions/device", json=body.model_dump(), timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "PUT", "/fyi/deliveryoptions/device", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS)
+    get_fyi_delivery_options.cache.clear()
+    return result
 
 
 @router.post(
@@ -123,19 +114,11 @@ async def configure_device_delivery_options(body: DeviceDeliveryOptionsRequest =
     summary="Get FYI Settings",
     description="Returns a list of disclaimer-type notifications."
 )
-async def get_fyi_settings(body: FYISettingsGetRequest = Body(...)):
+async def get_fyi_settings(request: Request, body: FYISettingsGetRequest = Body(...)):
     """
     Retrieves the settings for a list of disclaimer type notifications.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(f"{BASE_URL}/fyi/settings", json=body.model_dump(), timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "POST", "/fyi/settings", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS)
 
 
 @router.put(
@@ -145,21 +128,14 @@ async def get_fyi_settings(body: FYISettingsGetRequest = Body(...)):
     description="Enables or disables a specific disclaimer-type notification."
 )
 async def configure_fyi_setting(
+    request: Request,
     typecode: str = Path(..., description="The FYI type code to configure."),
     body: FYISettingsRequest = Body(...)
 ):
     """
     Enables or disables a specific FYI setting by its type code.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.put(f"{BASE_URL}/fyi/settings/{typecode}", json=body.model_dump(), timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "PUT", f"/fyi/settings/{typecode}", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS)
 
 
 @router.delete(
@@ -168,22 +144,16 @@ async def configure_fyi_setting(
     summary="Mark Notifications as Read",
     description="Marks a list of notifications as read."
 )
-async def mark_notifications_as_read(body: MarkReadRequest = Body(...)):
+async def mark_notifications_as_read(request: Request, body: MarkReadRequest = Body(...)):
     """
     Marks one or more notifications as read by their IDs.
     Note: The documentation specifies using a DELETE method with a request body.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            # Using request to handle DELETE with body, as httpx.delete doesn't directly support it.
-            request = client.build_request("DELETE", f"{BASE_URL}/fyi/notifications", json=body.model_dump())
-            response = await client.send(request, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    # AsyncClient.request accepts a body for DELETE, unlike the client.delete() shortcut.
+    result = await ibkr(request, "DELETE", "/fyi/notifications", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS)
+    get_fyi_unread_number.cache.clear()
+    get_notifications.cache.clear()
+    return result
 
 
 @router.get(
@@ -192,26 +162,17 @@ async def mark_notifications_as_read(body: MarkReadRequest = Body(...)):
     summary="Get Notifications",
     description="Returns a list of notifications."
 )
+@cached(ttl=UNREAD_TTL)
 async def get_notifications(
+    request: Request,
     exclude: Optional[str] = Query(None, description="A comma-separated list of notification IDs to exclude from the response."),
     include: Optional[str] = Query(None, description="A comma-separated list of notification IDs to include in the response."),
-    max_count: int = Query(10, alias="max", description="The maximum number of notifications to return.")
+    max_count: int = Query(10, alias="max", description=f"The maximum number of notifications to return (capped at {MAX_NOTIFICATIONS}).")
 ):
     """
     Retrieves a list of notifications, with options to filter and limit the results.
     """
-    params = {"max": max_count}
-    if exclude:
-        params["exclude"] = exclude
-    if include:
-        params["include"] = include
-        
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/fyi/notifications", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    # Large pages pin a multi-megabyte body per concurrent caller, so cap the page size server-side.
+    params = query(max=min(max_count, MAX_NOTIFICATIONS), exclude=exclude, include=include)
+    # Notification lists can be slow to assemble on the gateway side, so allow a longer read.
+    return await ibkr(request, "GET", "/fyi/notifications", params=params, timeout=read_timeout(30))
@@ -1,11 +1,56 @@
 # market_data.py
-from fastapi import APIRouter, Query, Body, Path
+import asyncio
+import hashlib
+import re
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache
+import orjson
+from fastapi import APIRouter, FastAPI, Query, Body, Path, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from typing import List, Dict, Any, Union, Optional
 import httpx
-from pydantic import BaseModel, Field
-from mcp_server.config import BASE_URL
+from pydantic import BaseModel, Field, ConfigDict
+from mcp_server.batcher import Coalescer
+from mcp_server.cache import SingleFlightTTL
+from mcp_server.config import IBKR_HISTORY_CACHE_TTL, IBKR_HMDS_AUTH_REFRESH
+from mcp_server.http_client import JSON_HEADERS, ibkr, ibkr_errors, ibkr_stream, is_error, query, read_timeout, send
 
-router = APIRouter()
+
+# --- HMDS Session ---
+# HMDS needs /hmds/auth/init once per brokerage session, not before every history call. A background task
+# initialises it at startup and re-runs it every IBKR_HMDS_AUTH_REFRESH seconds; history requests only
+# call it themselves while no init has succeeded yet (e.g. the gateway was logged in after startup).
+
+_hmds_ready = asyncio.Event()
+
+async def _hmds_auth_refresher(app: FastAPI) -> None:
+    while True:
+        try:
+            response = await send(app.state.ibkr, "GET", "/hmds/auth/init")
+            response.raise_for_status()
+            _hmds_ready.set()
+        except httpx.HTTPError:
+            _hmds_ready.clear()
+        await asyncio.sleep(IBKR_HMDS_AUTH_REFRESH)
+
+async def _ensure_hmds_auth(request: Request) -> None:
+    if not _hmds_ready.is_set():
+        if not is_error(await ibkr(request, "GET", "/hmds/auth/init")):
+            _hmds_ready.set()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Runs the HMDS auth refresher for the lifetime of the app (nested inside the app lifespan, so the shared client exists)."""
+    task = asyncio.create_task(_hmds_auth_refresher(app))
+    try:
+        yield
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+
+router = APIRouter(lifespan=lifespan)
 
 # --- Pydantic Models ---
 
@@ -13,6 +58,60 @@ class UnsubscribeRequest(BaseModel):
     """Request model for unsubscribing from a market data conid."""
     conid: str = Field(..., description="The contract ID to unsubscribe from.")
 
+    model_config = ConfigDict(frozen=True)
+
+
+# --- Snapshot Subscriptions ---
+# The gateway answers the first snapshot request for a conid/field with little or no data while it
+# opens the subscription. Remember which pairs have been requested so only new ones pay for a priming call.
+
+_primed: set = set()
+
+def forget_primed() -> None:
+    """Forgets every primed pair; a new brokerage session (reauthentication, logout) starts without subscriptions."""
+    _primed.clear()
+
+# --- Snapshot Batching ---
+# Snapshots requested within a few milliseconds of each other are merged into one gateway call for the
+# union of their conids and fields, then split back out per caller.
+
+_SNAPSHOT_WINDOW_MS = 10
+# Snapshot requests per batch; a fuller batch is sent at once (the gateway caps a snapshot at 100 conids).
+_SNAPSHOT_BATCH_MAX = 100
+
+async def _fetch_snapshots(client: httpx.AsyncClient, keys: List[tuple]) -> dict:
+    conids = sorted({conid for conid, _ in keys})
+    fields = sorted({field for _, wanted_fields in keys for field in wanted_fields})
+    params = {"conids": ",".join(conids), "fields": ",".join(fields)}
+    wanted = {(conid, field) for conid in conids for field in fields}
+    if not wanted <= _primed:
+        await send(client, "GET", "/iserver/marketdata/snapshot", params=params)
+    response = await send(client, "GET", "/iserver/marketdata/snapshot", params=params)
+    response.raise_for_status()
+    _primed.update(wanted)
+    by_conid = {str(item.get("conid")): item for item in orjson.loads(response.content)}
+    results = {}
+    for conid, wanted_fields in keys:
+        item = by_conid.get(conid)
+        if item is not None:
+            # Drop fields only other callers in the batch asked for; non-numeric keys (conid, _updated, ...) are metadata.
+            item = {key: value for key, value in item.items() if not key.isdigit() or key in wanted_fields}
+        results[(conid, wanted_fields)] = item
+    return results
+
+_snapshot_batcher = Coalescer(_SNAPSHOT_WINDOW_MS, _fetch_snapshots, max_batch=_SNAPSHOT_BATCH_MAX)
+
+# Coalesces identical snapshot requests that arrive while one is already in flight (nothing is kept afterwards).
+_snapshot_flight = SingleFlightTTL(0)
+
+@ibkr_errors
+async def _fetch_snapshot(request: Request, conids: str, fields: str) -> Any:
+    conid_list = [conid.strip() for conid in conids.split(",") if conid.strip()]
+    wanted_fields = tuple(field.strip() for field in fields.split(",") if field.strip())
+    client = request.app.state.ibkr
+    items = await asyncio.gather(*(_snapshot_batcher.submit(client, (conid, wanted_fields)) for conid in conid_list))
+    return ORJSONResponse([item for item in items if item is not None])
+
 
 # --- Market Data Field and Availability Information ---
 
@@ -61,43 +160,219 @@ ISERVER_HISTORY_RULES = {
 }
 
 
+# --- Static Responses ---
+# The tables above never change, so serialize them once and let repeat callers revalidate with If-None-Match.
+
+def _static_json(payload: Any) -> tuple:
+    """Serializes a constant once and returns its JSON bytes with a strong ETag."""
+    body = orjson.dumps(payload)
+    return body, f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+
+def _static_response(request: Request, body: bytes, etag: str) -> Response:
+    """Returns the pre-serialized body, or an empty 304 when the caller already holds this version."""
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+FIELDS_JSON, FIELDS_ETAG = _static_json(MARKET_DATA_FIELDS)
+AVAILABILITY_JSON, AVAILABILITY_ETAG = _static_json(MARKET_DATA_AVAILABILITY)
+HMDS_RULES_JSON, HMDS_RULES_ETAG = _static_json(HMDS_HISTORY_RULES)
+ISERVER_RULES_JSON, ISERVER_RULES_ETAG = _static_json(ISERVER_HISTORY_RULES)
+
+
+# --- History Params ---
+
+# Query-string spelling of a bool; a missing outsideRth means false.
+_BOOL = ("false", "true")
+
+@lru_cache(maxsize=1024)
+def _history_params(
+    conid: str,
+    period: str,
+    outsideRth: Optional[bool],
+    bar: Optional[str] = None,
+    exchange: Optional[str] = None,
+    barType: Optional[str] = None,
+    startTime: Optional[str] = None,
+) -> tuple:
+    """
+    Builds the history query as a hashable tuple of pairs, which httpx accepts as `params` directly.
+    Dashboards re-request the same few conid/period combinations, so repeat calls are a cache hit.
+    """
+    pairs = (
+        ("conid", conid),
+        ("period", period),
+        ("outsideRth", _BOOL[bool(outsideRth)]),
+        ("bar", bar),
+        ("exchange", exchange),
+        ("barType", barType),
+        ("startTime", startTime),
+    )
+    return tuple((key, value) for key, value in pairs if value)
+
+
+# --- History Cache ---
+# Identical history queries return the same bars until the current bar closes, so dashboards refreshing
+# the same charts are served from memory instead of the gateway.
+
+_history_cache = SingleFlightTTL(IBKR_HISTORY_CACHE_TTL)
+
+# Seconds per bar unit. iServer uses 'm' for months and 'min' for minutes.
+_BAR_UNIT_SECONDS = {
+    "s": 1, "sec": 1, "secs": 1,
+    "min": 60, "mins": 60,
+    "h": 3600, "hr": 3600, "hrs": 3600, "hour": 3600, "hours": 3600,
+    "d": 86400, "w": 604800, "m": 2592000, "y": 31536000,
+}
+
+def _bar_ttl(bar: Optional[str]) -> float:
+    """Caches a response for one bar, capped at `IBKR_HISTORY_CACHE_TTL`; unknown or missing bars get the cap."""
+    match = re.fullmatch(r"(\d+)\s*([A-Za-z]+)", bar or "")
+    if match and match.group(2) in _BAR_UNIT_SECONDS:
+        return min(int(match.group(1)) * _BAR_UNIT_SECONDS[match.group(2)], IBKR_HISTORY_CACHE_TTL)
+    return IBKR_HISTORY_CACHE_TTL
+
+# Futures for history fetches in progress, resolved with the body (or error response) so concurrent identical
+# queries wait for one upstream call instead of each making their own. None means the fetch failed.
+_history_inflight: Dict[tuple, asyncio.Future] = {}
+# Background readers of leader streams; kept referenced so they are not garbage-collected mid-read.
+_history_readers = set()
+
+def _finish_history(key: tuple, done: asyncio.Future, result: Any) -> None:
+    if not done.done():
+        done.set_result(result)
+    if _history_inflight.get(key) is done:
+        del _history_inflight[key]
+
+async def _read_history(chunks, key: tuple, ttl: float, done: asyncio.Future, queue: asyncio.Queue, gone: asyncio.Event) -> None:
+    """
+    Reads the leader's upstream body into `queue` and, once complete, the cache. Runs as its own task so waiters are
+    resolved (and the upstream response closed) even if the leader's client goes away before its body is sent; once
+    `gone` is set the chunks are no longer queued, only kept for the cache.
+    """
+    body = bytearray()
+    try:
+        async for chunk in chunks:
+            body += chunk
+            if not gone.is_set():
+                queue.put_nowait(chunk)
+        payload = bytes(body)
+        _history_cache.put(key, payload, ttl)
+        _finish_history(key, done, payload)
+    finally:
+        _finish_history(key, done, None)
+        queue.put_nowait(None)
+
+async def _drain(queue: asyncio.Queue, reader: asyncio.Task, gone: asyncio.Event):
+    """Yields the chunks `reader` queues for the leader's own response, then re-raises its failure, if any."""
+    try:
+        while (chunk := await queue.get()) is not None:
+            yield chunk
+    finally:
+        gone.set()
+    await reader
+
+def _reader_done(task: asyncio.Task) -> None:
+    _history_readers.discard(task)
+    if not task.cancelled():
+        task.exception()  # Mark as retrieved; the leader's client may never read it.
+
+async def _history(request: Request, path: str, params: tuple, bar: Optional[str], read: float, prepare=None, on_error=None) -> Any:
+    """
+    Serves a history query from the cache, from an identical fetch already in flight, or by streaming it from the gateway.
+    `prepare` is awaited before a real upstream call (e.g. HMDS auth); `on_error` is called when the gateway answers it
+    with an error status (e.g. to redo HMDS auth on the next call).
+    """
+    key = (path, params)
+    ttl = _bar_ttl(bar)
+    if ttl <= 0:
+        # Caching is off, so there is nothing to share; stream straight through without buffering the body.
+        if prepare is not None:
+            await prepare()
+        result = await ibkr_stream(request, "GET", path, params=params, timeout=read_timeout(read))
+        if on_error is not None and is_error(result):
+            on_error()
+        return result
+    while True:
+        cached = _history_cache.get(key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+        inflight = _history_inflight.get(key)
+        if inflight is None:
+            break
+        # Shield so a waiter going away does not cancel the leader's fetch. No timeout of its own: the upstream read
+        # timeout fails a stalled download, which resolves this too, while a slow but healthy one is waited out.
+        result = await asyncio.shield(inflight)
+        if isinstance(result, bytes):
+            return Response(content=result, media_type="application/json")
+        if result is not None:
+            return result  # The leader's error response.
+        # The leader's fetch failed; retry, becoming the leader if nobody else has.
+
+    done = asyncio.get_running_loop().create_future()
+    _history_inflight[key] = done
+    try:
+        if prepare is not None:
+            await prepare()
+        result = await ibkr_stream(request, "GET", path, params=params, timeout=read_timeout(read))
+    except BaseException:
+        _finish_history(key, done, None)
+        raise
+    if not isinstance(result, StreamingResponse):
+        if on_error is not None and is_error(result):
+            on_error()
+        _finish_history(key, done, result)
+        return result
+    queue, gone = asyncio.Queue(), asyncio.Event()
+    reader = asyncio.create_task(_read_history(result.body_iterator, key, ttl, done, queue, gone))
+    _history_readers.add(reader)
+    reader.add_done_callback(_reader_done)
+    result.body_iterator = _drain(queue, reader, gone)
+    return result
+
+
 # --- Market Data Router Endpoints ---
 
 @router.get(
     "/iserver/marketdata/fields",
     tags=["Market Data"],
     summary="Available Market Data Fields",
-    description="Returns a list of all available fields for the Market Data Snapshot endpoint."
+    description="Returns a list of all available fields for the Market Data Snapshot endpoint.",
+    response_model=List[Dict[str, str]]
 )
-async def get_available_fields() -> List[Dict[str, str]]:
-    return MARKET_DATA_FIELDS
+async def get_available_fields(request: Request) -> Response:
+    return _static_response(request, FIELDS_JSON, FIELDS_ETAG)
 
 @router.get(
     "/iserver/marketdata/availability",
     tags=["Market Data"],
     summary="Market Data Availability Codes",
-    description="Returns a dictionary explaining the codes used in the 'Market Data Availability' field (6509)."
+    description="Returns a dictionary explaining the codes used in the 'Market Data Availability' field (6509).",
+    response_model=Dict[str, Dict[str, str]]
 )
-async def get_availability_codes() -> Dict[str, Dict[str, str]]:
-    return MARKET_DATA_AVAILABILITY
+async def get_availability_codes(request: Request) -> Response:
+    return _static_response(request, AVAILABILITY_JSON, AVAILABILITY_ETAG)
 
 @router.get(
     "/hmds/history/rules",
     tags=["Market Data"],
     summary="Get HMDS History Rules",
-    description="Returns the valid period and bar size units for the /hmds/history endpoint."
+    description="Returns the valid period and bar size units for the /hmds/history endpoint.",
+    response_model=Dict[str, Any]
 )
-async def get_hmds_history_rules() -> Dict[str, Any]:
-    return HMDS_HISTORY_RULES
+async def get_hmds_history_rules(request: Request) -> Response:
+    return _static_response(request, HMDS_RULES_JSON, HMDS_RULES_ETAG)
 
 @router.get(
     "/iserver/marketdata/history/rules",
     tags=["Market Data"],
     summary="Get iServer History Rules",
-    description="Returns the valid period, bar, and step-size rules for the /iserver/marketdata/history endpoint."
+    description="Returns the valid period, bar, and step-size rules for the /iserver/marketdata/history endpoint.",
+    response_model=Dict[str, Any]
 )
-async def get_iserver_history_rules() -> Dict[str, Any]:
-    return ISERVER_HISTORY_RULES
+async def get_iserver_history_rules(request: Request) -> Response:
+    return _static_response(request, ISERVER_RULES_JSON, ISERVER_RULES_ETAG)
 
 
 @router.get(
@@ -107,24 +382,16 @@ async def get_iserver_history_rules() -> Dict[str, Any]:
     description="Get a snapshot of market data for one or more contracts."
 )
 async def get_marketdata_snapshot(
+    request: Request,
     conids: str = Query(..., description="A comma-separated list of contract IDs."),
     fields: str = Query(..., description="A comma-separated list of field codes.")
 ) -> List[Dict[str, Any]]:
     """
     ### Get Market Data Snapshot
-    Fetches a snapshot of market data. This endpoint is called twice internally to ensure data retrieval.
+    Fetches a snapshot of market data. Contracts or fields not requested before are primed with an extra call first to ensure data retrieval.
+    Concurrent requests are batched into a single gateway call.
     """
-    params = {"conids": conids, "fields": fields}
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            await client.get(f"{BASE_URL}/iserver/marketdata/snapshot", params=params, timeout=10)
-            response = await client.get(f"{BASE_URL}/iserver/marketdata/snapshot", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await _snapshot_flight.get_or_fetch((conids, fields), lambda: _fetch_snapshot(request, conids, fields))
 
 @router.get(
     "/md/snapshot",
@@ -133,21 +400,12 @@ async def get_marketdata_snapshot(
     description="Get a snapshot of market data for a list of conids."
 )
 async def get_md_snapshot(
+    request: Request,
     conids: str = Query(..., description="A comma-separated list of contract IDs."),
     fields: Optional[str] = Query(None, description="A comma-separated list of field codes.")
 ):
-    params = {"conids": conids}
-    if fields:
-        params["fields"] = fields
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/md/snapshot", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = query(conids=conids, fields=fields)
+    return await ibkr(request, "GET", "/md/snapshot", params=params, passthrough=True)
 
 
 @router.get(
@@ -157,6 +415,7 @@ async def get_md_snapshot(
     description="Get historical market data for a contract. Use `/iserver/marketdata/history/rules` for valid parameters."
 )
 async def get_marketdata_history(
+    request: Request,
     conid: str = Query(..., description="The contract ID."),
     period: str = Query(..., description="The time period for the request, e.g., '1d', '2w'."),
     bar: Optional[str] = Query(None, description="The bar size, e.g., '1min', '1h'."),
@@ -164,26 +423,8 @@ async def get_marketdata_history(
     outsideRth: Optional[bool] = Query(False, description="Set to true to include data outside regular trading hours."),
     barType: Optional[str] = Query("trades", description="The type of data to return, e.g., 'trades', 'midpoint'.")
 ):
-    params = {
-        "conid": conid,
-        "period": period,
-        "outsideRth": str(outsideRth).lower()
-    }
-    if bar:
-        params["bar"] = bar
-    if exchange:
-        params["exchange"] = exchange
-    if barType:
-        params["barType"] = barType
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/marketdata/history", params=params, timeout=20)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = _history_params(conid, period, outsideRth, bar=bar, exchange=exchange, barType=barType)
+    return await _history(request, "/iserver/marketdata/history", params, bar, read=20)
 
 
 @router.get(
@@ -193,6 +434,7 @@ async def get_marketdata_history(
     description="Get historical market data from the HMDS. Use `/hmds/history/rules` for valid parameters."
 )
 async def get_hmds_history(
+    request: Request,
     conid: str = Query(..., description="The contract ID."),
     period: str = Query(..., description="The time period. Note: units are case-sensitive."),
     bar: Optional[str] = Query(None, description="The bar size. Note: allowed units depend on the period."),
@@ -201,29 +443,11 @@ async def get_hmds_history(
     startTime: Optional[str] = Query(None, description="Specify the start time of the query in 'YYYYMMDD-hh:mm:ss' format.")
 ):
     """
-    Fetches deeper historical market data using the HMDS. It first calls /hmds/auth/init to authenticate the session.
+    Fetches deeper historical market data using the HMDS. The HMDS session is authenticated (/hmds/auth/init) in the background.
     """
-    params = {
-        "conid": conid,
-        "period": period,
-        "outsideRth": str(outsideRth).lower()
-    }
-    if bar:
-        params["bar"] = bar
-    if barType:
-        params["barType"] = barType
-    if startTime:
-        params["startTime"] = startTime
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            await client.get(f"{BASE_URL}/hmds/auth/init", timeout=10)
-            response = await client.get(f"{BASE_URL}/hmds/history", params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = _history_params(conid, period, outsideRth, bar=bar, barType=barType, startTime=startTime)
+    return await _history(request, "/hmds/history", params, bar, read=30,
+                          prepare=lambda: _ensure_hmds_auth(request), on_error=_hmds_ready.clear)
 
 @router.post(
     "/iserver/marketdata/unsubscribe",
@@ -231,16 +455,9 @@ async def get_hmds_history(
     summary="Unsubscribe from Market Data",
     description="Unsubscribes from a specific market data feed."
 )
-async def unsubscribe_market_data(body: UnsubscribeRequest = Body(...)):
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(f"{BASE_URL}/iserver/marketdata/unsubscribe", json=body.model_dump(), timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+async def unsubscribe_market_data(request: Request, body: UnsubscribeRequest = Body(...)):
+    _primed.difference_update({pair for pair in _primed if pair[0] == body.conid})
+    return await ibkr(request, "POST", "/iserver/marketdata/unsubscribe", content=body.model_dump_json(), headers=JSON_HEADERS, passthrough=True)
 
 
 @router.post(
@@ -249,13 +466,6 @@ async def unsubscribe_market_data(body: UnsubscribeRequest = Body(...)):
     summary="Unsubscribe from All Market Data",
     description="Unsubscribes from all current market data subscriptions."
 )
-async def unsubscribe_all_market_data():
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(f"{BASE_URL}/iserver/marketdata/unsubscribeall", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+async def unsubscribe_all_market_data(request: Request):
+    forget_primed()
+    return await ibkr(request, "POST", "/iserver/marketdata/unsubscribeall", passthrough=True)
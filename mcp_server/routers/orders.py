@@ -1,9 +1,9 @@
 # orders.py
-from fastapi import APIRouter, Query, Body, Path
-from typing import Optional, List, Dict, Any
-import httpx
-from pydantic import BaseModel, Field
-from mcp_server.config import BASE_URL
+from fastapi import APIRouter, Query, Body, Path, Request
+from typing import Optional, List, Dict, Union
+from pydantic import BaseModel, Field, ConfigDict
+from mcp_server.http_client import JSON_HEADERS, ibkr
+from portfolio import forget_positions
 
 router = APIRouter()
 
@@ -31,17 +31,23 @@ class OrderModel(BaseModel):
     quantity: float = Field(..., description="The number of shares or contracts to trade.")
     useAdaptive: Optional[bool] = Field(False, description="Set to true to use the Price Management Algo.")
     strategy: Optional[str] = Field(None, description="The IB Algo strategy to use.")
-    strategyParameters: Optional[Dict[str, Any]] = Field(None, description="A dictionary of parameters for the specified IB Algo strategy.")
+    strategyParameters: Optional[Dict[str, Union[str, bool, int, float]]] = Field(None, description="A dictionary of parameters for the specified IB Algo strategy.")
+
+    model_config = ConfigDict(frozen=True)
 
 
 class OrdersRequest(BaseModel):
     """Request model for placing one or more orders."""
     orders: List[OrderModel]
 
+    model_config = ConfigDict(frozen=True)
+
 class ReplyRequest(BaseModel):
     """Request model for confirming an order with a reply ID."""
     confirmed: bool = Field(..., description="Set to true to confirm and submit the order.")
 
+    model_config = ConfigDict(frozen=True)
+
 
 # --- Orders Router Endpoints ---
 
@@ -52,25 +58,17 @@ class ReplyRequest(BaseModel):
     description="Place one or more orders. For bracket or OCA orders, use the cOID of the parent in the parentId field of the child orders."
 )
 async def place_order(
+    request: Request,
     accountId: str = Path(..., description="The account ID to place the order for."),
     body: OrdersRequest = Body(...)
 ):
     """
     Places one or more orders for the specified account.
+    Cached position pages are dropped afterwards, since fills change them.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/iserver/account/{accountId}/orders",
-                json=body.model_dump(exclude_none=True),
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "POST", f"/iserver/account/{accountId}/orders", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS, passthrough=True)
+    forget_positions()
+    return result
 
 
 @router.post(
@@ -80,25 +78,14 @@ async def place_order(
     description="Preview an order without submitting it to get commission and margin impact information."
 )
 async def preview_order(
+    request: Request,
     accountId: str = Path(..., description="The account ID for the what-if analysis."),
     body: OrdersRequest = Body(...)
 ):
     """
     Previews an order to see its potential impact on the account before placing it.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/iserver/account/{accountId}/orders/whatif",
-                json=body.model_dump(exclude_none=True),
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "POST", f"/iserver/account/{accountId}/orders/whatif", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS, passthrough=True)
 
 
 @router.post(
@@ -108,6 +95,7 @@ async def preview_order(
     description="Modifies an existing open order."
 )
 async def modify_order(
+    request: Request,
     accountId: str = Path(..., description="The account ID of the order."),
     orderId: str = Path(..., description="The order ID of the order to modify."),
     body: OrderModel = Body(...)
@@ -115,19 +103,9 @@ async def modify_order(
     """
     Modifies an existing active order. The request body should contain the updated order details.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/iserver/account/{accountId}/order/{orderId}",
-                json=body.model_dump(exclude_none=True),
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "POST", f"/iserver/account/{accountId}/order/{orderId}", content=body.model_dump_json(exclude_none=True), headers=JSON_HEADERS, passthrough=True)
+    forget_positions()
+    return result
 
 
 @router.delete(
@@ -137,24 +115,16 @@ async def modify_order(
     description="Cancels an open order."
 )
 async def cancel_order(
+    request: Request,
     accountId: str = Path(..., description="The account ID of the order."),
     orderId: str = Path(..., description="The order ID of the order to cancel.")
 ):
     """
     Cancels an active order by its ID.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.delete(
-                f"{BASE_URL}/iserver/account/{accountId}/order/{orderId}",
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "DELETE", f"/iserver/account/{accountId}/order/{orderId}", passthrough=True)
+    forget_positions()
+    return result
 
 
 @router.post(
@@ -164,22 +134,13 @@ async def cancel_order(
     description="Reply to a confirmation message received after attempting to place an order."
 )
 async def place_order_reply(
+    request: Request,
     replyId: str = Path(..., description="The ID of the message to reply to."),
     body: ReplyRequest = Body(...)
 ):
     """
     Confirms an order that requires a secondary confirmation (e.g., due to price or size constraints).
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/iserver/reply/{replyId}",
-                json=body.model_dump(),
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "POST", f"/iserver/reply/{replyId}", content=body.model_dump_json(), headers=JSON_HEADERS, passthrough=True)
+    forget_positions()
+    return result
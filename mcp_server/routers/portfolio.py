@@ -1,18 +1,118 @@
 # portfolio.py
-from fastapi import APIRouter, Body, Path, Query
-from typing import List, Optional
+import asyncio
+from contextlib import suppress
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Body, Path, Query, Request
+from fastapi.responses import ORJSONResponse
 import httpx
-from pydantic import BaseModel, Field
-from mcp_server.config import BASE_URL
+import orjson
+from pydantic import BaseModel, Field, ConfigDict
+from mcp_server.cache import SingleFlightTTL, cached
+from mcp_server.http_client import JSON_HEADERS, error_body, ibkr, ibkr_errors, ibkr_stream, json_body, query, read_timeout, send
 
 router = APIRouter()
 
+# Account lists and metadata change at human timescales; balances move with the market.
+ACCOUNT_TTL = 30
+BALANCE_TTL = 5
+
 # --- Pydantic Models ---
 
 class AccountAllocationRequest(BaseModel):
     """Request model for fetching portfolio allocation across multiple accounts."""
     acctIds: List[str] = Field(..., description="List of account IDs to retrieve allocation for.")
 
+class BulkPositionsRequest(BaseModel):
+    """Request model for fetching one page of positions for several accounts at once."""
+    accountIds: List[str] = Field(..., description="List of account IDs to retrieve positions for.")
+    pageId: int = Field(0, description="The page ID for pagination. Starts at 0.")
+    model: Optional[str] = Field(None, description="The model to query positions for.")
+    sort: Optional[str] = Field(None, description="The field to sort by.")
+    direction: Optional[str] = Field(None, description="The sort direction: 'a' for ascending, 'd' for descending.")
+    period: Optional[str] = Field(None, description="The period for which to retrieve positions.")
+
+    model_config = ConfigDict(frozen=True)
+
+class AccountOverview(BaseModel):
+    """Response model for the combined account overview; each section is the gateway's payload or an error."""
+    meta: Any = Field(None, description="Account metadata, as returned by /portfolio/{accountId}/meta.")
+    summary: Any = Field(None, description="Account summary, as returned by /portfolio/{accountId}/summary.")
+    ledger: Any = Field(None, description="Cash balances by currency, as returned by /portfolio/{accountId}/ledger.")
+    allocation: Any = Field(None, description="Allocation by asset class, industry and category, as returned by /portfolio/{accountId}/allocation.")
+    comboPositions: Any = Field(None, description="Combination positions, as returned by /portfolio/{accountId}/combo/positions.")
+
+# Overview section -> gateway path under /portfolio/{accountId}/.
+_OVERVIEW_SECTIONS = {
+    "meta": "meta",
+    "summary": "summary",
+    "ledger": "ledger",
+    "allocation": "allocation",
+    "comboPositions": "combo/positions",
+}
+
+_overview_cache = SingleFlightTTL(BALANCE_TTL)
+
+def _overview_complete(overview: Dict[str, Any]) -> bool:
+    """An overview with a failed section must not be cached, or the failure would be served for `BALANCE_TTL`."""
+    return not any(isinstance(section, dict) and "error" in section for section in overview.values())
+
+
+# --- Fan-out Helpers ---
+
+async def _get_json(client: httpx.AsyncClient, path: str, **kwargs) -> Any:
+    response = await send(client, "GET", path, **kwargs)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+async def _gather_json(request: Request, paths: Dict[str, str], **kwargs) -> Dict[str, Any]:
+    """
+    Fetches several gateway paths concurrently and returns their JSON bodies keyed like `paths`.
+    A failed call is reported under its key as the usual error payload instead of failing the whole response.
+    """
+    client = request.app.state.ibkr
+    results = await asyncio.gather(*(_get_json(client, path, **kwargs) for path in paths.values()), return_exceptions=True)
+    combined = {}
+    for key, result in zip(paths, results):
+        if isinstance(result, httpx.HTTPError):
+            result = error_body(result)
+        elif isinstance(result, BaseException):
+            raise result
+        combined[key] = result
+    return combined
+
+
+# --- Positions Prefetch ---
+# Clients paginate positions linearly, so a full page triggers a background fetch of the next one and the
+# following call is served from `_positions_cache` instead of waiting a full round trip on the gateway.
+
+POSITIONS_TTL = 5
+# Assumes the gateway's fixed page size for /portfolio/{accountId}/positions/{pageId}: 100 positions, with a shorter
+# page being the last one. The size is not reported in the response; if IBKR changes it, update this value. If it
+# is set too high, no page counts as full and prefetching stops. If it is set too low, the last page also triggers
+# a prefetch of an empty page.
+POSITIONS_PAGE_SIZE = 100
+
+_positions_cache = SingleFlightTTL(POSITIONS_TTL)
+_prefetch_tasks = set()
+
+def forget_positions() -> None:
+    """Drops cached position pages, e.g. after an order changes them."""
+    _positions_cache.clear()
+
+async def _fetch_positions(client: httpx.AsyncClient, accountId: str, pageId: int, params: tuple) -> Any:
+    path = f"/portfolio/{accountId}/positions/{pageId}"
+    return await _positions_cache.get_or_fetch(
+        (accountId, pageId, params), lambda: _get_json(client, path, params=params)
+    )
+
+
+async def _prefetch_positions(client: httpx.AsyncClient, accountId: str, pageId: int, params: tuple) -> None:
+    # Only pages requested by a caller trigger a prefetch, so this never runs more than one page ahead.
+    # Best effort: any failure is dropped; the caller's own request for the page will retry and report it.
+    with suppress(Exception):
+        await _fetch_positions(client, accountId, pageId, params)
+
 
 # --- Router Endpoints ---
 
@@ -22,19 +122,12 @@ class AccountAllocationRequest(BaseModel):
     summary="Portfolio Accounts",
     description="In non-tiered account structures, returns a list of accounts for which the user can view position and account information. This endpoint must be called prior to calling other /portfolio endpoints for those accounts."
 )
-async def get_portfolio_accounts():
+@cached(ttl=ACCOUNT_TTL)
+async def get_portfolio_accounts(request: Request):
     """
     Fetches the list of available portfolio accounts.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/accounts", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/portfolio/accounts", passthrough=True, revalidate=True)
 
 @router.get(
     "/portfolio/subaccounts",
@@ -42,19 +135,12 @@ async def get_portfolio_accounts():
     summary="Portfolio Subaccounts",
     description="Used in tiered account structures (such as Financial Advisor and IBroker) to return a list of up to 100 sub-accounts for which the user can view position and account-related information. This endpoint must be called prior to calling other /portfolio endpoints for those sub-accounts."
 )
-async def get_portfolio_subaccounts():
+@cached(ttl=ACCOUNT_TTL)
+async def get_portfolio_subaccounts(request: Request):
     """
     Retrieves a list of subaccounts for the portfolio, primarily for tiered account structures.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/subaccounts", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/portfolio/subaccounts", passthrough=True, revalidate=True)
 
 @router.get(
     "/portfolio/subaccounts2",
@@ -62,21 +148,15 @@ async def get_portfolio_subaccounts():
     summary="Portfolio Subaccounts (Large Account Structures)",
     description="Used in large tiered account structures to return a list of sub-accounts for which the user can view position and account-related information. This endpoint must be called prior to calling other /portfolio endpoints for those sub-accounts."
 )
-async def get_portfolio_subaccounts_large():
+@cached(ttl=0)
+async def get_portfolio_subaccounts_large(request: Request):
     """
     Retrieves a list of subaccounts for large portfolio structures.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            # Note: The documentation suggests this might be a GET, but a POST with a body might be needed in practice for large lists.
-            # Assuming GET based on the doc for now.
-            response = await client.get(f"{BASE_URL}/portfolio/subaccounts2", timeout=30) # Longer timeout for potentially large responses
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    # Note: The documentation suggests this might be a GET, but a POST with a body might be needed in practice for large lists.
+    # Assuming GET based on the doc for now.
+    # Longer timeout for potentially large responses.
+    return await ibkr(request, "GET", "/portfolio/subaccounts2", timeout=read_timeout(30), passthrough=True)
 
 
 @router.get(
@@ -85,21 +165,15 @@ async def get_portfolio_subaccounts_large():
     summary="Specific Account's Portfolio Information",
     description="Returns information about the account, including the account's name, currency, and other metadata."
 )
+@cached(ttl=ACCOUNT_TTL)
 async def get_account_meta(
+    request: Request,
     accountId: str = Path(..., description="The account ID.")
 ):
     """
     Fetches metadata for a specific portfolio account.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/{accountId}/meta", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/portfolio/{accountId}/meta", passthrough=True, revalidate=True)
 
 
 @router.get(
@@ -108,21 +182,15 @@ async def get_account_meta(
     summary="Portfolio Allocation (Single)",
     description="Returns a list of positions and their allocation by asset class, industry, and category for a single account."
 )
+@cached(ttl=0)
 async def get_account_allocation(
+    request: Request,
     accountId: str = Path(..., description="The account ID.")
 ):
     """
     Fetches portfolio allocation for a single specified account.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/{accountId}/allocation", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/portfolio/{accountId}/allocation", passthrough=True, revalidate=True)
 
 
 @router.get(
@@ -131,46 +199,31 @@ async def get_account_allocation(
     summary="Combination Positions",
     description="Returns a list of combination positions for a single account."
 )
+@cached(ttl=0)
 async def get_combo_positions(
+    request: Request,
     accountId: str = Path(..., description="The account ID.")
 ):
     """
     Retrieves combination positions (e.g., complex options strategies) for an account.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/{accountId}/combo/positions", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/portfolio/{accountId}/combo/positions", passthrough=True)
 
 
 @router.post(
     "/portfolio/allocation",
     tags=["Portfolio"],
     summary="Portfolio Allocation (All)",
-    description="Returns portfolio allocation information for multiple accounts combined. The accounts are specified in the request body."
+    description="Returns portfolio allocation information for multiple accounts combined. The accounts are specified in the request body.",
+    openapi_extra=json_body(AccountAllocationRequest),
 )
-async def get_all_accounts_allocation(body: AccountAllocationRequest = Body(...)):
+async def get_all_accounts_allocation(request: Request):
     """
     Fetches combined portfolio allocation for a list of specified accounts.
+    The body is forwarded as sent; the gateway validates it.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/portfolio/allocation",
-                json=body.model_dump(),
-                timeout=20
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    # Streamed: combined allocation for many accounts can run to several MB.
+    return await ibkr_stream(request, "POST", "/portfolio/allocation", content=await request.body(), headers=JSON_HEADERS, timeout=read_timeout(20))
 
 
 @router.get(
@@ -179,7 +232,9 @@ async def get_all_accounts_allocation(body: AccountAllocationRequest = Body(...)
     summary="Positions",
     description="Returns a list of positions for the given account. The endpoint is paginated by page ID."
 )
+@ibkr_errors
 async def get_positions(
+    request: Request,
     accountId: str = Path(..., description="The account ID."),
     pageId: int = Path(..., description="The page ID for pagination. Starts at 0."),
     model: Optional[str] = Query(None, description="The model to query positions for."),
@@ -189,26 +244,36 @@ async def get_positions(
 ):
     """
     Fetches paginated positions for a specific account.
+    Pages are cached for `POSITIONS_TTL` seconds, and the next page is prefetched in the background.
+    """
+    client = request.app.state.ibkr
+    params = tuple(query(model=model, sort=sort, direction=direction, period=period).items())
+    positions = await _fetch_positions(client, accountId, pageId, params)
+    # A full page means there is probably another one; fetch it while the caller processes this one.
+    if (
+        isinstance(positions, list)
+        and len(positions) >= POSITIONS_PAGE_SIZE
+        and _positions_cache.get((accountId, pageId + 1, params)) is None
+    ):
+        task = asyncio.create_task(_prefetch_positions(client, accountId, pageId + 1, params))
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_tasks.discard)
+    return ORJSONResponse(positions)
+
+
+@router.post(
+    "/portfolio/positions/batch",
+    tags=["Portfolio"],
+    summary="Positions (Multiple Accounts)",
+    description="Returns one page of positions for each of the given accounts, keyed by account ID. The accounts are fetched concurrently; an account that fails is returned with its error instead of failing the whole request."
+)
+async def get_positions_batch(request: Request, body: BulkPositionsRequest = Body(...)):
+    """
+    Fetches the same page of positions for several accounts in one call.
     """
-    params = {}
-    if model:
-        params["model"] = model
-    if sort:
-        params["sort"] = sort
-    if direction:
-        params["direction"] = direction
-    if period:
-        params["period"] = period
-        
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/{accountId}/positions/{pageId}", params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    params = query(model=body.model, sort=body.sort, direction=body.direction, period=body.period)
+    paths = {accountId: f"/portfolio/{accountId}/positions/{body.pageId}" for accountId in dict.fromkeys(body.accountIds)}
+    return ORJSONResponse(await _gather_json(request, paths, params=params))
 
 
 @router.get(
@@ -217,22 +282,16 @@ async def get_positions(
     summary="Positions by Conid",
     description="Returns a list of all positions matching the given contract ID (conid)."
 )
+@cached(ttl=0)
 async def get_position_by_conid(
+    request: Request,
     acctId: str = Path(..., description="The account ID."),
     conid: int = Path(..., description="The contract ID.")
 ):
     """
     Retrieves all positions for a specific contract within a given account.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/{acctId}/position/{conid}", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/portfolio/{acctId}/position/{conid}", passthrough=True)
 
 
 @router.post(
@@ -242,20 +301,18 @@ async def get_position_by_conid(
     description="Invalidates the backend portfolio cache for the specified account, forcing a refresh of portfolio data."
 )
 async def invalidate_portfolio_cache(
+    request: Request,
     accountId: str = Path(..., description="The account ID.")
 ):
     """
     Clears the cached portfolio data on the server side for the specified account.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(f"{BASE_URL}/portfolio/{accountId}/positions/invalidate", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "POST", f"/portfolio/{accountId}/positions/invalidate", passthrough=True)
+    forget_positions()
+    get_account_summary.cache.clear()
+    get_account_ledger.cache.clear()
+    _overview_cache.clear()
+    return result
 
 
 @router.get(
@@ -264,21 +321,15 @@ async def invalidate_portfolio_cache(
     summary="Portfolio Summary",
     description="Returns a summary of account information and portfolio positions."
 )
+@cached(ttl=BALANCE_TTL)
 async def get_account_summary(
+    request: Request,
     accountId: str = Path(..., description="The account ID.")
 ):
     """
     Fetches a summary of the specified account's portfolio.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/{accountId}/summary", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/portfolio/{accountId}/summary", passthrough=True)
 
 
 @router.get(
@@ -287,21 +338,37 @@ async def get_account_summary(
     summary="Portfolio Ledger",
     description="Returns the cash balance and other ledger information for the specified account."
 )
+@cached(ttl=BALANCE_TTL)
 async def get_account_ledger(
+    request: Request,
     accountId: str = Path(..., description="The account ID.")
 ):
     """
     Retrieves the ledger for a specific account, showing cash balances and other financial details.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/{accountId}/ledger", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/portfolio/{accountId}/ledger", passthrough=True, revalidate=True)
+
+
+@router.get(
+    "/portfolio/{accountId}/overview",
+    tags=["Portfolio"],
+    summary="Account Overview",
+    description="Returns the account's metadata, summary, ledger, allocation and combination positions in one response. The five gateway calls are made concurrently; a section that fails is returned with its error instead of failing the whole request.",
+    response_model=AccountOverview,
+)
+async def get_account_overview(
+    request: Request,
+    accountId: str = Path(..., description="The account ID.")
+):
+    """
+    Fetches everything a dashboard shows for one account in a single call.
+    Complete overviews are cached for `BALANCE_TTL` seconds.
+    """
+    paths = {section: f"/portfolio/{accountId}/{endpoint}" for section, endpoint in _OVERVIEW_SECTIONS.items()}
+    overview = await _overview_cache.get_or_fetch(
+        accountId, lambda: _gather_json(request, paths), cacheable=_overview_complete
+    )
+    return ORJSONResponse(overview)
 
 
 @router.get(
@@ -310,18 +377,12 @@ async def get_account_ledger(
     summary="Position & Contract Info",
     description="Returns a list of all positions matching the conid, along with the contract information."
 )
+@cached(ttl=0)
 async def get_all_positions_by_conid(
+    request: Request,
     conid: int = Path(..., description="The contract ID.")
 ):
     """
     Fetches all positions for a given contract ID across all portfolio accounts.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/portfolio/positions/{conid}", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
\ No newline at end of file
+    return await ibkr(request, "GET", f"/portfolio/positions/{conid}", passthrough=True)
\ No newline at end of file
@@ -2,6 +2,7 @@
 from fastapi import APIRouter
 import httpx
 from mcp_server.config import BASE_URL
+from market_data import forget_primed
 
 router = APIRouter()
 
@@ -57,6 +58,7 @@ async def reauthenticate():
     """
     When the session has been idle for a long time, it may expire. This endpoint can be used to re-authenticate the session.
     """
+    forget_primed()
     async with httpx.AsyncClient(verify=False) as client:
         try:
             response = await client.post(f"{BASE_URL}/iserver/reauthenticate", timeout=10)
@@ -77,6 +79,7 @@ async def logout():
     """
     Terminates the current brokerage session.
     """
+    forget_primed()
     async with httpx.AsyncClient(verify=False) as client:
         try:
             response = await client.post(f"{BASE_URL}/logout", timeout=10)
@@ -1,9 +1,12 @@
 # watchlists.py
-from fastapi import APIRouter, Body, Path
+import asyncio
+from fastapi import APIRouter, Body, Path, Request
+from fastapi.responses import ORJSONResponse
 from typing import List, Optional
 import httpx
 from pydantic import BaseModel, Field
-from mcp_server.config import BASE_URL
+from mcp_server.cache import cached
+from mcp_server.http_client import JSON_HEADERS, error_body, ibkr, json_body, send
 
 router = APIRouter()
 
@@ -18,6 +21,10 @@ class WatchlistContractsRequest(BaseModel):
     """Request model for adding contracts to a watchlist."""
     conids: List[str] = Field(..., description="A list of contract IDs to add.")
 
+class WatchlistBulkDeleteRequest(BaseModel):
+    """Request model for removing several contracts from a watchlist."""
+    conids: List[str] = Field(..., description="A list of contract IDs to delete.")
+
 
 # --- Watchlists Router Endpoints ---
 
@@ -27,19 +34,12 @@ class WatchlistContractsRequest(BaseModel):
     summary="Get Watchlists",
     description="Returns a list of all watchlists for the current user."
 )
-async def get_watchlists():
+@cached(ttl=30)
+async def get_watchlists(request: Request):
     """
     Retrieves all watchlists associated with the current user's account.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/account/watchlists", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", "/iserver/account/watchlists", passthrough=True)
 
 @router.get(
     "/iserver/account/watchlist/{watchlistId}",
@@ -47,58 +47,45 @@ async def get_watchlists():
     summary="Get Watchlist Contracts",
     description="Returns a list of contracts for a specific watchlist."
 )
+@cached(ttl=0)
 async def get_watchlist_contracts(
+    request: Request,
     watchlistId: str = Path(..., description="The ID of the watchlist.")
 ):
     """
     Retrieves all contracts within a specific watchlist.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.get(f"{BASE_URL}/iserver/account/watchlist/{watchlistId}", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "GET", f"/iserver/account/watchlist/{watchlistId}", passthrough=True)
 
 @router.post(
     "/iserver/account/{accountId}/watchlist",
     tags=["Watchlists"],
     summary="Create Watchlist",
-    description="Creates a new watchlist."
+    description="Creates a new watchlist.",
+    openapi_extra=json_body(WatchlistCreateRequest),
 )
 async def create_watchlist(
-    accountId: str = Path(..., description="The account ID."),
-    body: WatchlistCreateRequest = Body(...)
+    request: Request,
+    accountId: str = Path(..., description="The account ID.")
 ):
     """
     Creates a new watchlist for the specified account with an optional list of initial contracts.
+    The body is forwarded as sent; the gateway validates it.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/iserver/account/{accountId}/watchlist",
-                json=body.model_dump(exclude_none=True),
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "POST", f"/iserver/account/{accountId}/watchlist", content=await request.body(), headers=JSON_HEADERS, passthrough=True)
+    get_watchlists.cache.clear()
+    return result
 
 @router.post(
     "/iserver/account/watchlist/{watchlistId}/contract",
     tags=["Watchlists"],
     summary="Add Contracts to Watchlist",
-    description="Adds one or more contracts to an existing watchlist."
+    description="Adds one or more contracts to an existing watchlist.",
+    openapi_extra=json_body(WatchlistContractsRequest),
 )
 async def add_contracts_to_watchlist(
-    watchlistId: str = Path(..., description="The ID of the watchlist."),
-    body: WatchlistContractsRequest = Body(...)
+    request: Request,
+    watchlistId: str = Path(..., description="The ID of the watchlist.")
 ):
     """
     Adds one or more contracts to a specified watchlist.
@@ -107,19 +94,8 @@ async def add_contracts_to_watchlist(
     # The API might expect a single `conid` key. If this call fails, adjust the model and this call accordingly.
     # For now, we assume a more flexible `conids` list can be handled or that the first element is used.
     # A safer single-conid implementation would be: `json={"conid": body.conids[0]}` if only one is allowed.
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/iserver/account/watchlist/{watchlistId}/contract",
-                json=body.model_dump(),
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    # The body is forwarded as sent; the gateway validates it.
+    return await ibkr(request, "POST", f"/iserver/account/watchlist/{watchlistId}/contract", content=await request.body(), headers=JSON_HEADERS, passthrough=True)
 
 @router.delete(
     "/iserver/account/watchlist/{watchlistId}",
@@ -128,20 +104,15 @@ async def add_contracts_to_watchlist(
     description="Deletes a specific watchlist."
 )
 async def delete_watchlist(
+    request: Request,
     watchlistId: str = Path(..., description="The ID of the watchlist to delete.")
 ):
     """
     Deletes an entire watchlist by its ID.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.delete(f"{BASE_URL}/iserver/account/watchlist/{watchlistId}", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    result = await ibkr(request, "DELETE", f"/iserver/account/watchlist/{watchlistId}", passthrough=True)
+    get_watchlists.cache.clear()
+    return result
 
 @router.delete(
     "/iserver/account/watchlist/{watchlistId}/contract/{conid}",
@@ -150,18 +121,44 @@ async def delete_watchlist(
     description="Deletes a single contract from a specific watchlist."
 )
 async def delete_contract_from_watchlist(
+    request: Request,
     watchlistId: str = Path(..., description="The ID of the watchlist."),
     conid: str = Path(..., description="The contract ID to delete.")
 ):
     """
     Removes a single contract from a specified watchlist.
     """
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.delete(f"{BASE_URL}/iserver/account/watchlist/{watchlistId}/contract/{conid}", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as exc:
-            return {"error": "IBKR API Error", "status_code": exc.response.status_code, "detail": exc.response.text}
-        except httpx.RequestError as exc:
-            return {"error": "Request Error", "detail": str(exc)}
+    return await ibkr(request, "DELETE", f"/iserver/account/watchlist/{watchlistId}/contract/{conid}", passthrough=True)
+
+@router.post(
+    "/iserver/account/watchlist/{watchlistId}/contracts/delete",
+    tags=["Watchlists"],
+    summary="Delete Contracts from Watchlist",
+    description="Deletes several contracts from a specific watchlist in one call. The contracts are deleted concurrently; the response lists the conids that were deleted and those that failed, with their errors."
+)
+async def delete_contracts_from_watchlist(
+    request: Request,
+    watchlistId: str = Path(..., description="The ID of the watchlist."),
+    body: WatchlistBulkDeleteRequest = Body(...)
+):
+    """
+    Removes several contracts from a specified watchlist.
+    The gateway has no bulk delete, so this fans out one single-contract delete per conid.
+    """
+    client = request.app.state.ibkr
+
+    async def delete(conid: str) -> None:
+        response = await send(client, "DELETE", f"/iserver/account/watchlist/{watchlistId}/contract/{conid}")
+        response.raise_for_status()
+
+    conids = list(dict.fromkeys(body.conids))
+    results = await asyncio.gather(*(delete(conid) for conid in conids), return_exceptions=True)
+    deleted, failed = [], []
+    for conid, result in zip(conids, results):
+        if isinstance(result, httpx.HTTPError):
+            failed.append({"conid": conid, **error_body(result)})
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            deleted.append(conid)
+    return ORJSONResponse({"deleted": deleted, "failed": failed})
@@ -0,0 +1,70 @@
+# conftest.py
+import inspect
+import os
+from typing import Callable, List
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI
+
+# config.py reads these at import time.
+os.environ.setdefault("MCP_SERVER_PORT", "5002")
+os.environ.setdefault("ROUTERS_PATH", os.path.join(os.path.dirname(__file__), "..", "routers"))
+
+GATEWAY_URL = "https://gateway/v1/api"
+
+
+class FakeGateway:
+    """
+    Stands in for the IBKR gateway behind an httpx.MockTransport.
+    Every request is recorded in `requests`; `reply` (sync or async) builds the response for it.
+    """
+
+    def __init__(self):
+        self.requests: List[httpx.Request] = []
+        self.reply: Callable = lambda request: httpx.Response(200, json={})
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        response = self.reply(request)
+        if inspect.isawaitable(response):
+            response = await response
+        return response
+
+    def paths(self) -> List[str]:
+        return [request.url.path.removeprefix("/v1/api") for request in self.requests]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def gateway() -> FakeGateway:
+    return FakeGateway()
+
+
+@pytest.fixture
+def gateway_client(gateway) -> httpx.AsyncClient:
+    """The shared IBKR client, as the app lifespan would create it, talking to the fake gateway."""
+    return httpx.AsyncClient(base_url=GATEWAY_URL, transport=httpx.MockTransport(gateway))
+
+
+@pytest.fixture
+def make_app(gateway_client):
+    """Builds an app serving `routers`, whose shared IBKR client talks to the fake gateway."""
+    def factory(*routers: APIRouter) -> FastAPI:
+        app = FastAPI()
+        for router in routers:
+            app.include_router(router)
+        app.state.ibkr = gateway_client
+        return app
+    return factory
+
+
+@pytest.fixture
+def make_client(make_app):
+    """Returns an httpx client that calls the app built from `routers` in-process."""
+    def factory(*routers: APIRouter) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=make_app(*routers)), base_url="http://test")
+    return factory
@@ -0,0 +1,64 @@
+# test_batcher.py
+import asyncio
+import httpx
+import pytest
+import contract
+from mcp_server.batcher import Coalescer
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_keys_submitted_together_are_fetched_in_one_batch():
+    batches = []
+
+    async def fetch(client, keys):
+        batches.append(keys)
+        return {key: key.upper() for key in keys if key != "missing"}
+
+    batcher = Coalescer(5, fetch)
+    results = await asyncio.gather(*(batcher.submit(None, key) for key in ["a", "b", "a", "missing"]))
+
+    assert results == ["A", "B", "A", None]
+    assert batches == [["a", "b", "missing"]]
+
+
+async def test_a_failed_batch_fails_every_caller_in_it():
+    async def fetch(client, keys):
+        raise RuntimeError("gateway down")
+
+    batcher = Coalescer(5, fetch)
+    results = await asyncio.gather(batcher.submit(None, "a"), batcher.submit(None, "b"), return_exceptions=True)
+
+    assert [str(result) for result in results] == ["gateway down", "gateway down"]
+
+
+async def test_a_full_batch_is_flushed_without_waiting_for_the_window():
+    batches = []
+
+    async def fetch(client, keys):
+        batches.append(keys)
+        return {key: key for key in keys}
+
+    batcher = Coalescer(1000, fetch, max_batch=2)
+    results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(None, key) for key in ["a", "b", "c", "d"])), 0.5)
+
+    assert results == ["a", "b", "c", "d"]
+    assert batches == [["a", "b"], ["c", "d"]]
+
+
+async def test_concurrent_symbol_lookups_become_one_gateway_request(gateway, make_client):
+    def stocks(request):
+        symbols = request.url.params["symbols"].split(",")
+        return httpx.Response(200, json={symbol: [{"name": symbol}] for symbol in symbols})
+    gateway.reply = stocks
+
+    async with make_client(contract.router) as client:
+        aapl, msft = await asyncio.gather(
+            client.get("/trsrv/stocks", params={"symbols": "AAPL"}),
+            client.get("/trsrv/stocks", params={"symbols": "MSFT"}),
+        )
+
+    assert aapl.json() == {"AAPL": [{"name": "AAPL"}]}
+    assert msft.json() == {"MSFT": [{"name": "MSFT"}]}
+    assert len(gateway.requests) == 1
+    assert sorted(gateway.requests[0].url.params["symbols"].split(",")) == ["AAPL", "MSFT"]
@@ -0,0 +1,55 @@
+# test_cache.py
+import asyncio
+import httpx
+import pytest
+import contract
+from mcp_server.cache import SingleFlightTTL
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_lookups_share_one_gateway_call(gateway, make_client):
+    async def slow(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"conid": 101})
+    gateway.reply = slow
+
+    async with make_client(contract.router) as client:
+        first, second = await asyncio.gather(
+            client.get("/iserver/contract/101/info"), client.get("/iserver/contract/101/info")
+        )
+        third = await client.get("/iserver/contract/101/info")
+
+    assert first.json() == second.json() == third.json() == {"conid": 101}
+    assert gateway.paths() == ["/iserver/contract/101/info"]
+
+
+async def test_gateway_errors_are_not_cached(gateway, make_client):
+    gateway.reply = lambda request: httpx.Response(400, text="unknown conid")
+    async with make_client(contract.router) as client:
+        await client.get("/iserver/contract/102/info")
+        gateway.reply = lambda request: httpx.Response(200, json={"conid": 102})
+        response = await client.get("/iserver/contract/102/info")
+
+    assert response.json() == {"conid": 102}
+    assert len(gateway.requests) == 2
+
+
+async def test_fetch_in_flight_during_clear_is_not_stored():
+    cache = SingleFlightTTL(60)
+    release = asyncio.Event()
+
+    async def stale():
+        await release.wait()
+        return "stale"
+
+    fetch = asyncio.create_task(cache.get_or_fetch("key", stale))
+    await asyncio.sleep(0)
+    cache.clear()
+    release.set()
+
+    # The caller still gets its result, but the value read before the clear is not cached.
+    assert await fetch == "stale"
+    assert cache.get("key") is None
+    assert await cache.get_or_fetch("key", lambda: asyncio.sleep(0, result="fresh")) == "fresh"
+    assert cache.get("key") == "fresh"
@@ -0,0 +1,114 @@
+# test_http_client.py
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi import APIRouter, Request
+from mcp_server import http_client
+
+pytestmark = pytest.mark.anyio
+
+
+def replies(*outcomes):
+    """Answers successive gateway requests with `outcomes`, raising the ones that are exceptions."""
+    remaining = iter(outcomes)
+
+    def reply(request):
+        outcome = next(remaining)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome, json={"status": outcome})
+    return reply
+
+
+async def test_get_is_retried_with_backoff_after_5xx(gateway, gateway_client, monkeypatch):
+    monkeypatch.setattr(http_client, "IBKR_RETRY_BACKOFF", 0.01)
+    gateway.reply = replies(503, 502, 200)
+
+    started = time.monotonic()
+    response = await http_client.send(gateway_client, "GET", "/iserver/accounts")
+
+    assert response.status_code == 200
+    assert len(gateway.requests) == 3
+    # Backoff doubles: 0.01 s, then 0.02 s.
+    assert time.monotonic() - started >= 0.03
+
+
+async def test_get_is_retried_after_a_dropped_connection(gateway, gateway_client, monkeypatch):
+    monkeypatch.setattr(http_client, "IBKR_RETRY_BACKOFF", 0)
+    gateway.reply = replies(httpx.RemoteProtocolError("Server disconnected"), 200)
+
+    response = await http_client.send(gateway_client, "GET", "/iserver/accounts")
+
+    assert response.status_code == 200
+    assert len(gateway.requests) == 2
+
+
+async def test_last_response_is_returned_once_retries_run_out(gateway, gateway_client, monkeypatch):
+    monkeypatch.setattr(http_client, "IBKR_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(http_client, "IBKR_RETRIES", 2)
+    gateway.reply = replies(503, 503, 503)
+
+    response = await http_client.send(gateway_client, "GET", "/iserver/accounts")
+
+    assert response.status_code == 503
+    assert len(gateway.requests) == 3
+
+
+async def test_post_is_never_replayed(gateway, gateway_client, monkeypatch):
+    monkeypatch.setattr(http_client, "IBKR_RETRY_BACKOFF", 0)
+    gateway.reply = replies(503)
+
+    response = await http_client.send(gateway_client, "POST", "/iserver/account/U1/orders")
+
+    assert response.status_code == 503
+    assert len(gateway.requests) == 1
+
+
+def gateway_app(make_app, call):
+    """An app with one endpoint that makes `call(request)` against the fake gateway."""
+    router = APIRouter()
+
+    @router.get("/probe")
+    async def probe(request: Request):
+        return await call(request)
+
+    return make_app(router)
+
+
+async def test_requests_over_the_concurrency_limit_get_503(gateway, make_app, monkeypatch):
+    monkeypatch.setattr(http_client, "_gate", asyncio.Semaphore(1))
+    monkeypatch.setattr(http_client, "IBKR_QUEUE_TIMEOUT", 0.05)
+
+    async def slow(request):
+        await asyncio.sleep(0.3)
+        return httpx.Response(200, json={})
+    gateway.reply = slow
+
+    app = gateway_app(make_app, lambda request: http_client.ibkr(request, "GET", "/iserver/accounts"))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        responses = await asyncio.gather(client.get("/probe"), client.get("/probe"))
+
+    assert sorted(response.status_code for response in responses) == [200, 503]
+    assert len(gateway.requests) == 1
+
+
+async def test_revalidated_response_is_replayed_on_304(gateway, make_app):
+    def ledger(request):
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={"USD": {"cashbalance": 100}}, headers={"etag": '"v1"'})
+    gateway.reply = ledger
+
+    app = gateway_app(
+        make_app,
+        lambda request: http_client.ibkr(request, "GET", "/portfolio/U9/ledger", passthrough=True, revalidate=True),
+    )
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.get("/probe")
+        second = await client.get("/probe")
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json() == {"USD": {"cashbalance": 100}}
+    assert "if-none-match" not in gateway.requests[0].headers
+    assert gateway.requests[1].headers["if-none-match"] == '"v1"'
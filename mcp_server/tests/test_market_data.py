@@ -0,0 +1,37 @@
+# test_market_data.py
+import httpx
+import pytest
+import market_data
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_static_tables_revalidate_with_their_etag(gateway, make_client):
+    async with make_client(market_data.router) as client:
+        first = await client.get("/iserver/marketdata/fields")
+        etag = first.headers["etag"]
+        unchanged = await client.get("/iserver/marketdata/fields", headers={"If-None-Match": etag})
+        stale = await client.get("/iserver/marketdata/fields", headers={"If-None-Match": '"stale"'})
+
+    assert first.status_code == 200
+    assert first.json() == market_data.MARKET_DATA_FIELDS
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["etag"] == etag
+    assert stale.status_code == 200
+    assert stale.content == first.content
+    assert not gateway.requests
+
+
+async def test_snapshot_fields_are_primed_again_after_a_session_reset(gateway, make_client):
+    gateway.reply = lambda request: httpx.Response(200, json=[{"conid": 1311, "31": "101.5"}])
+    query = {"conids": "1311", "fields": "31"}
+    async with make_client(market_data.router) as client:
+        await client.get("/iserver/marketdata/snapshot", params=query)
+        await client.get("/iserver/marketdata/snapshot", params=query)
+        market_data.forget_primed()
+        response = await client.get("/iserver/marketdata/snapshot", params=query)
+
+    assert response.json() == [{"conid": 1311, "31": "101.5"}]
+    # Primed on the first call, served directly on the second, primed again after the reset.
+    assert len(gateway.requests) == 5
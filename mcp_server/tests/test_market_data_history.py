@@ -0,0 +1,123 @@
+# test_market_data_history.py
+import asyncio
+import httpx
+import pytest
+from starlette.requests import ClientDisconnect
+import market_data
+
+pytestmark = pytest.mark.anyio
+
+HISTORY_PATH = "/iserver/marketdata/history"
+BARS = b'{"data": [{"o": 1, "c": 2}]}'
+
+
+def bars(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, content=BARS, headers={"content-type": "application/json"})
+
+
+async def test_repeat_query_is_served_from_the_cache(gateway, make_client):
+    gateway.reply = bars
+    query = {"conid": "1301", "period": "1d", "bar": "1min"}
+    async with make_client(market_data.router) as client:
+        first = await client.get(HISTORY_PATH, params=query)
+        second = await client.get(HISTORY_PATH, params=query)
+
+    assert first.content == second.content == BARS
+    assert len(gateway.requests) == 1
+
+
+async def test_gateway_errors_are_not_cached(gateway, make_client):
+    gateway.reply = lambda request: httpx.Response(400, text="bad conid")
+    query = {"conid": "1302", "period": "1d", "bar": "1min"}
+    async with make_client(market_data.router) as client:
+        await client.get(HISTORY_PATH, params=query)
+        gateway.reply = bars
+        response = await client.get(HISTORY_PATH, params=query)
+
+    assert response.content == BARS
+    assert len(gateway.requests) == 2
+
+
+async def drop_before_body(app, path: str, query: bytes) -> None:
+    """Calls `app` like a client that goes away as soon as the response starts."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": [],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("client went away")
+
+    with pytest.raises((OSError, ClientDisconnect)):
+        await app(scope, receive, send)
+
+
+async def test_client_dropped_before_the_body_does_not_block_later_requests(gateway, make_app):
+    gateway.reply = bars
+    app = make_app(market_data.router)
+    query = {"conid": "1303", "period": "1d", "bar": "1min"}
+
+    await drop_before_body(app, HISTORY_PATH, str(httpx.QueryParams(query)).encode())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        # The dropped caller's fetch still completes (and is cached); the repeat call must not wait on it.
+        response = await asyncio.wait_for(client.get(HISTORY_PATH, params=query), 2)
+
+    assert response.content == BARS
+    assert len(gateway.requests) == 1
+
+
+async def test_hmds_error_makes_the_next_call_reauthenticate(gateway, make_client):
+    def reply(request):
+        if request.url.path.endswith("/hmds/auth/init"):
+            return httpx.Response(200, json={})
+        return httpx.Response(401, text="session expired")
+    gateway.reply = reply
+    query = {"conid": "1304", "period": "1d", "bar": "1min"}
+
+    async with make_client(market_data.router) as client:
+        first = await client.get("/hmds/history", params=query)
+        second = await client.get("/hmds/history", params=query)
+
+    assert first.status_code == second.status_code == 401
+    assert gateway.paths()[-2:] == ["/hmds/auth/init", "/hmds/history"]
+
+
+async def test_concurrent_queries_share_a_slow_download(gateway, make_client):
+    async def trickle():
+        for chunk in (BARS[:10], BARS[10:]):
+            await asyncio.sleep(0.05)
+            yield chunk
+
+    gateway.reply = lambda request: httpx.Response(200, content=trickle(), headers={"content-type": "application/json"})
+    query = {"conid": "1305", "period": "1d", "bar": "1min"}
+    async with make_client(market_data.router) as client:
+        responses = await asyncio.gather(*(client.get(HISTORY_PATH, params=query) for _ in range(3)))
+
+    assert [response.content for response in responses] == [BARS] * 3
+    assert len(gateway.requests) == 1
+
+
+async def test_history_is_streamed_through_when_caching_is_off(gateway, make_client, monkeypatch):
+    monkeypatch.setattr(market_data, "IBKR_HISTORY_CACHE_TTL", 0)
+    gateway.reply = bars
+    query = {"conid": "1306", "period": "1d", "bar": "1min"}
+    async with make_client(market_data.router) as client:
+        await client.get(HISTORY_PATH, params=query)
+        response = await client.get(HISTORY_PATH, params=query)
+
+    assert response.content == BARS
+    assert len(gateway.requests) == 2
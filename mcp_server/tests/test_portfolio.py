@@ -0,0 +1,123 @@
+# test_portfolio.py
+import asyncio
+import httpx
+import pytest
+import orders
+import portfolio
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_bulk_positions_returns_each_account_with_its_own_errors(gateway, make_client):
+    def positions(request):
+        account = request.url.path.split("/")[4]
+        if account == "U2":
+            return httpx.Response(400, text="unknown account")
+        return httpx.Response(200, json=[{"acctId": account, "conid": 265598}])
+    gateway.reply = positions
+
+    async with make_client(portfolio.router) as client:
+        response = await client.post(
+            "/portfolio/positions/batch", json={"accountIds": ["U1", "U2", "U1"], "pageId": 1, "sort": "position"}
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "U1": [{"acctId": "U1", "conid": 265598}],
+        "U2": {"error": "IBKR API Error", "status_code": 400, "detail": "unknown account"},
+    }
+    assert sorted(gateway.paths()) == ["/portfolio/U1/positions/1", "/portfolio/U2/positions/1"]
+    assert all(request.url.params["sort"] == "position" for request in gateway.requests)
+
+
+def overview_sections(failing: str):
+    def reply(request):
+        if request.url.path.endswith(failing):
+            return httpx.Response(400, text="bad account")
+        return httpx.Response(200, json={"ok": True})
+    return reply
+
+
+async def test_overview_with_a_failed_section_is_not_cached(gateway, make_client):
+    gateway.reply = overview_sections(failing="/ledger")
+    async with make_client(portfolio.router) as client:
+        first = await client.get("/portfolio/U11/overview")
+        await client.get("/portfolio/U11/overview")
+
+    assert first.json()["ledger"]["error"] == "IBKR API Error"
+    assert first.json()["meta"] == {"ok": True}
+    assert len(gateway.requests) == 2 * len(portfolio._OVERVIEW_SECTIONS)
+
+
+async def test_complete_overview_is_cached(gateway, make_client):
+    gateway.reply = overview_sections(failing="/nothing")
+    async with make_client(portfolio.router) as client:
+        await client.get("/portfolio/U12/overview")
+        await client.get("/portfolio/U12/overview")
+
+    assert len(gateway.requests) == len(portfolio._OVERVIEW_SECTIONS)
+
+
+def position_pages(sizes: dict, failing: int = None):
+    """Answers each positions page with `sizes[pageId]` positions, or a 400 for page `failing`."""
+    def reply(request):
+        page = int(request.url.path.rsplit("/", 1)[1])
+        if page == failing:
+            return httpx.Response(400, text="bad page")
+        return httpx.Response(200, json=[{"conid": page * 1000 + i} for i in range(sizes.get(page, 0))])
+    return reply
+
+
+async def wait_for_requests(gateway, count: int) -> None:
+    """Gives a background prefetch time to reach the gateway."""
+    for _ in range(100):
+        if len(gateway.requests) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+
+async def test_full_positions_page_prefetches_the_next_one(gateway, make_client):
+    gateway.reply = position_pages({0: portfolio.POSITIONS_PAGE_SIZE, 1: 3})
+    async with make_client(portfolio.router) as client:
+        await client.get("/portfolio/U21/positions/0")
+        await wait_for_requests(gateway, 2)
+        response = await client.get("/portfolio/U21/positions/1")
+
+    assert len(response.json()) == 3
+    assert gateway.paths() == ["/portfolio/U21/positions/0", "/portfolio/U21/positions/1"]
+
+
+async def test_short_positions_page_does_not_prefetch(gateway, make_client):
+    gateway.reply = position_pages({0: 3})
+    async with make_client(portfolio.router) as client:
+        await client.get("/portfolio/U22/positions/0")
+        await asyncio.sleep(0.05)
+
+    assert gateway.paths() == ["/portfolio/U22/positions/0"]
+
+
+async def test_failed_prefetch_is_dropped_and_retried_by_the_caller(gateway, make_client):
+    gateway.reply = position_pages({0: portfolio.POSITIONS_PAGE_SIZE}, failing=1)
+    async with make_client(portfolio.router) as client:
+        first = await client.get("/portfolio/U23/positions/0")
+        await wait_for_requests(gateway, 2)
+        second = await client.get("/portfolio/U23/positions/1")
+
+    assert first.status_code == 200
+    assert second.status_code == 400
+    assert gateway.paths()[1:] == ["/portfolio/U23/positions/1", "/portfolio/U23/positions/1"]
+
+
+async def test_order_writes_drop_cached_positions(gateway, make_client):
+    gateway.reply = position_pages({0: 3})
+    async with make_client(portfolio.router, orders.router) as client:
+        await client.get("/portfolio/U24/positions/0")
+        await client.get("/portfolio/U24/positions/0")
+        await client.delete("/iserver/account/U24/order/7")
+        await client.get("/portfolio/U24/positions/0")
+
+    assert gateway.paths() == [
+        "/portfolio/U24/positions/0",
+        "/iserver/account/U24/order/7",
+        "/portfolio/U24/positions/0",
+    ]
@@ -0,0 +1,25 @@
+# test_watchlists.py
+import httpx
+import pytest
+import watchlists
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_bulk_delete_reports_deleted_and_failed_conids(gateway, make_client):
+    def delete(request):
+        if request.url.path.endswith("/contract/2"):
+            return httpx.Response(404, text="not in watchlist")
+        return httpx.Response(200, json={})
+    gateway.reply = delete
+
+    async with make_client(watchlists.router) as client:
+        response = await client.post("/iserver/account/watchlist/7/contracts/delete", json={"conids": ["1", "2", "1"]})
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "deleted": ["1"],
+        "failed": [{"conid": "2", "error": "IBKR API Error", "status_code": 404, "detail": "not in watchlist"}],
+    }
+    assert sorted(gateway.paths()) == ["/iserver/account/watchlist/7/contract/1", "/iserver/account/watchlist/7/contract/2"]
+    assert {request.method for request in gateway.requests} == {"DELETE"}